@@ -0,0 +1,101 @@
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'script'))
+
+
+class GeocodeStubHandler(BaseHTTPRequestHandler):
+    # Answers /maps/api/geocode/json like the Maps API, with configurable latency and failures
+    latency = 0.05
+    error_rate = 0.0
+    over_limit_rate = 0.0
+    requests_served = 0
+    lock = threading.Lock()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != '/maps/api/geocode/json':
+            self.send_error(404)
+            return
+        with self.lock:
+            GeocodeStubHandler.requests_served += 1
+        time.sleep(self.latency)
+        roll = random.random()
+        if roll < self.error_rate:
+            self.send_error(503)
+            return
+        address = parse_qs(url.query).get('address', [''])[0]
+        if roll < self.error_rate + self.over_limit_rate:
+            body = {'status': 'OVER_QUERY_LIMIT', 'results': []}
+        elif address.lower().startswith('nowhere'):
+            body = {'status': 'ZERO_RESULTS', 'results': []}
+        else:
+            # Deterministic coordinates so repeated runs return the same answer for a place
+            digest = hashlib.sha256(address.encode()).digest()
+            location = {'lat': digest[0] / 255 * 180 - 90, 'lng': digest[1] / 255 * 360 - 180}
+            body = {'status': 'OK', 'results': [{'geometry': {'location': location}}]}
+        payload = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub(port, latency, error_rate, over_limit_rate):
+    GeocodeStubHandler.latency = latency
+    GeocodeStubHandler.error_rate = error_rate
+    GeocodeStubHandler.over_limit_rate = over_limit_rate
+    server = ThreadingHTTPServer(('127.0.0.1', port), GeocodeStubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Geocode synthetic locations against a local Maps API stub.')
+    parser.add_argument('--locations', type=int, default=2000, help='Distinct locations to geocode')
+    parser.add_argument('--port', type=int, default=0, help='Stub server port (0 picks a free one)')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds the stub waits per request')
+    parser.add_argument('--error-rate', type=float, default=0.02, help='Share of requests answered with HTTP 503')
+    parser.add_argument('--over-limit-rate', type=float, default=0.02,
+                        help='Share of requests answered with OVER_QUERY_LIMIT')
+    parser.add_argument('--serve-only', action='store_true', help='Only run the stub server')
+    args = parser.parse_args()
+
+    server = start_stub(args.port, args.latency, args.error_rate, args.over_limit_rate)
+    base_url = f'http://127.0.0.1:{server.server_address[1]}'
+    if args.serve_only:
+        print(f"Geocoding stub listening on {base_url}")
+        threading.Event().wait()
+
+    # The client rejects keys that do not look like Google keys, even when talking to the stub
+    os.environ.setdefault('GOOGLE_API_KEY', 'AIzaStubKeyForLocalGeocodingBenchmarks')
+    os.environ['GEOCODE_BASE_URL'] = base_url
+    from cleaning import Geocoder
+
+    geocoder = Geocoder()
+    locations = [f'Town {number}, ST' for number in range(args.locations)] + ['Nowhere, XX']
+    started = time.perf_counter()
+    results = geocoder.geocode_locations(locations)
+    elapsed = time.perf_counter() - started
+
+    resolved = sum(1 for latitude, _ in results.values() if latitude is not None)
+    print(f"{len(locations)} locations in {elapsed:.1f} s ({len(locations) / elapsed:.1f}/s) with "
+          f"{geocoder.workers} workers at {geocoder.qps:g} QPS; {resolved} resolved, "
+          f"{GeocodeStubHandler.requests_served} requests served")
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import argparse
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'script'))
+
+from cleaning import DatabaseConnection
+
+TABLE_NAME = 'bench_processed_jobs'
+
+
+def synthetic_processed_jobs(rows, seed=0):
+    # Same columns and dtypes process_data hands to append_data
+    rng = np.random.default_rng(seed)
+    salaries = pd.array(rng.integers(40_000, 250_000, rows), dtype='Int64')
+    salaries[rng.random(rows) < 0.4] = pd.NA
+    post_dates = [date(2024, 1, 1) + timedelta(days=int(offset)) for offset in rng.integers(0, 365, rows)]
+    return pd.DataFrame({
+        'id': np.arange(rows, dtype='int64'),
+        'post_date': post_dates,
+        'job_link': [f'https://www.indeed.com/rc/clk?jk={key:016x}' for key in rng.integers(0, 2**62, rows)],
+        'job_title': rng.choice(['Software Engineer', 'Data Analyst', 'DevOps Engineer, "Cloud"'], rows),
+        'job_location': rng.choice(['Seattle, WA', 'Austin, TX', 'Remote'], rows),
+        'company_name': rng.choice(['Acme', 'Initech', 'Globex'], rows),
+        'salary': salaries,
+        'job_description': rng.choice(['Build services.\nShip often.', 'Analyze data', ''], rows),
+        'job_type': rng.choice(['Full-time', 'Contract', 'Not available'], rows),
+        'scrap_time': pd.Timestamp('2024-06-01', tz='UTC') + pd.to_timedelta(rng.integers(0, 86_400, rows), unit='s'),
+        'job_jk': [f'{key:016x}' for key in rng.integers(0, 2**62, rows)],
+        'location_keyword': '',
+    })
+
+
+def time_load(db, df, load):
+    with db.engine.begin() as conn:
+        conn.execute(text(f'TRUNCATE {TABLE_NAME}'))
+    started = time.perf_counter()
+    with db.engine.begin() as conn:
+        load(df, conn)
+    elapsed = time.perf_counter() - started
+    with db.engine.connect() as conn:
+        loaded = conn.execute(text(f'SELECT count(*) FROM {TABLE_NAME}')).scalar()
+    if loaded != len(df):
+        sys.exit(f"Expected {len(df)} rows in {TABLE_NAME}, found {loaded}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare DataFrame.to_sql with the COPY loader on Postgres.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 1_000_000], help='Frame sizes to load')
+    args = parser.parse_args()
+
+    load_dotenv()
+    db = DatabaseConnection()
+    try:
+        for rows in args.rows:
+            df = synthetic_processed_jobs(rows)
+            with db.engine.begin() as conn:
+                conn.execute(text(f'DROP TABLE IF EXISTS {TABLE_NAME}'))
+                # Created by pandas so both loaders write into the table the first cleaning run would create
+                df.head(0).to_sql(TABLE_NAME, conn, index=False)
+
+            to_sql_seconds = time_load(db, df, lambda frame, conn: frame.to_sql(
+                TABLE_NAME, conn, if_exists='append', index=False))
+            copy_seconds = time_load(db, df, lambda frame, conn: db.copy_data(frame, TABLE_NAME, conn))
+            print(f"{rows:>10,} rows  to_sql {rows / to_sql_seconds:12,.0f} rows/s ({to_sql_seconds:7.2f} s)  "
+                  f"COPY {rows / copy_seconds:12,.0f} rows/s ({copy_seconds:7.2f} s)  "
+                  f"speedup {to_sql_seconds / copy_seconds:5.1f}x")
+    finally:
+        with db.engine.begin() as conn:
+            conn.execute(text(f'DROP TABLE IF EXISTS {TABLE_NAME}'))
+        db.dispose()
+
+
+if __name__ == "__main__":
+    main()
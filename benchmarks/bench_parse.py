@@ -0,0 +1,77 @@
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from bs4 import BeautifulSoup
+from lxml import etree as et
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'script'))
+
+from job_scrapping import parse_page
+
+CARDS_XPATH = '//div[@class="job_seen_beacon"]'
+
+
+def parse_with_soup(page_content):
+    # The previous Browser.get_dom path: html.parser, serialize, then parse again with lxml
+    product_soup = BeautifulSoup(page_content, 'html.parser')
+    return et.HTML(str(product_soup))
+
+
+def load_pages(pages_dir):
+    pages = []
+    for name in sorted(os.listdir(pages_dir)):
+        if name.endswith(('.html', '.htm')):
+            with open(os.path.join(pages_dir, name), 'rb') as file:
+                pages.append((name, file.read()))
+    return pages
+
+
+def time_parser(parse, pages, repeat):
+    per_page = []
+    for _ in range(repeat):
+        for _, page_content in pages:
+            started = time.perf_counter()
+            parse(page_content)
+            per_page.append((time.perf_counter() - started) * 1000)
+    return per_page
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare per-page parse time of saved Indeed search pages.')
+    parser.add_argument('pages_dir', help='Directory of saved search result pages (*.html)')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of passes over the pages')
+    args = parser.parse_args()
+
+    pages = load_pages(args.pages_dir)
+    if not pages:
+        sys.exit(f"No .html pages found in {args.pages_dir}")
+
+    # Every parse path has to find the same job cards before its timing means anything
+    for name, page_content in pages:
+        expected = len(parse_with_soup(page_content).xpath(CARDS_XPATH))
+        for sanitize in (False, True):
+            found = len(parse_page(page_content, sanitize=sanitize).xpath(CARDS_XPATH))
+            if found != expected:
+                print(f"Warning: {name} has {expected} cards with BeautifulSoup but {found} with sanitize={sanitize}")
+
+    parsers = [
+        ('beautifulsoup round trip', parse_with_soup),
+        ('lxml direct', parse_page),
+        ('lxml direct, sanitized', lambda page_content: parse_page(page_content, sanitize=True)),
+    ]
+    print(f"{len(pages)} pages, {sum(len(page) for _, page in pages) / len(pages) / 1024:.0f} KB average, "
+          f"{args.repeat} passes")
+    baseline = None
+    for label, parse in parsers:
+        per_page = time_parser(parse, pages, args.repeat)
+        mean = statistics.mean(per_page)
+        baseline = baseline or mean
+        print(f"{label:<26} mean {mean:8.2f} ms/page  median {statistics.median(per_page):8.2f} ms/page  "
+              f"speedup {baseline / mean:5.1f}x")
+
+
+if __name__ == "__main__":
+    main()
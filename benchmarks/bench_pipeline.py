@@ -0,0 +1,344 @@
+import argparse
+import contextlib
+import hashlib
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+import psutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'script'))
+# Per-page and per-search log lines would otherwise interleave with the report
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+import job_scrapping
+from job_scrapping import Browser, HttpFetcher, JobDatabase, job_card_extractor, parse_page, scrape_jobs
+from cleaning import process_data
+
+SEARCH_RADIUS = 100
+PAGE_STARTS = range(0, 100, 10)
+
+TITLES = ['Software Engineer', 'Senior Data Analyst', 'Embedded Firmware Engineer', 'DevOps Engineer',
+          'Machine Learning Engineer', 'Cloud Architect']
+COMPANIES = ['Acme', 'Initech', 'Globex', 'Umbrella', 'Hooli']
+LOCATIONS = ['Seattle, WA', 'Austin, TX', 'Boston, MA', 'Remote', 'New York, NY 10001']
+SALARIES = ['$120,000 - $150,000 a year', '$55 - $70 an hour', '$9,000 a month', None]
+JOB_TYPES = ['Full-time', 'Contract', None]
+POST_DATES = ['Just posted', 'Today', 'Posted 3 days ago', 'Posted 30+ days ago']
+
+CARD_TEMPLATE = (
+    '<div class="job_seen_beacon"><table><tr><td>'
+    '<h2 class="jobTitle"><a class="jcs-JobTitle css-jspxzf" href="/rc/clk?jk={jk}&amp;fccid=1">'
+    '<span title="{title}">{title}</span></a></h2>'
+    '<div class="company_location"><span data-testid="company-name">{company}</span>'
+    '<div data-testid="text-location">{location}</div></div>'
+    '{salary}{job_type}'
+    '<div class="job-snippet"><ul><li>Build and ship {title} features.</li><li>Work with {company} teams.</li></ul></div>'
+    '<span class="date"><span class="visually-hidden">Posted</span>{post_date}</span>'
+    '</td></tr></table></div>'
+)
+
+
+def corpus_url(job_keyword, location_keyword, start):
+    return job_scrapping.pagination_url.format(job_keyword, location_keyword, SEARCH_RADIUS, start)
+
+
+def synthetic_page(rng, cards, page_kb):
+    # Search-result markup the extractor understands, padded with script and navigation weight like a live page
+    body = []
+    for _ in range(cards):
+        salary = rng.choice(SALARIES)
+        job_type = rng.choice(JOB_TYPES)
+        body.append(CARD_TEMPLATE.format(
+            jk=f'{rng.getrandbits(64):016x}', title=rng.choice(TITLES), company=rng.choice(COMPANIES),
+            location=rng.choice(LOCATIONS), post_date=rng.choice(POST_DATES),
+            salary=(f'<div class="salary-snippet-container"><div data-testid="attribute_snippet_testid">{salary}'
+                    '</div></div>') if salary else '',
+            job_type=(f'<div class="metadata"><div data-testid="attribute_snippet_testid">{job_type}</div></div>'
+                      if job_type else ''),
+        ))
+    cards_html = ''.join(body)
+    padding = max(0, page_kb * 1024 - len(cards_html))
+    script = 'window._initialData = ' + json.dumps({'filler': 'x' * (padding // 2)}) + ';'
+    nav = '<ul class="nav">' + '<li><a href="/q-jobs.html">Jobs</a></li>' * (padding // 2 // 40) + '</ul>'
+    return (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>Jobs</title><script>{script}</script></head>'
+            f'<body>{nav}<div id="mosaic-provider-jobcards">{cards_html}</div></body></html>').encode()
+
+
+def save_corpus(corpus_dir, searches, pages):
+    os.makedirs(corpus_dir, exist_ok=True)
+    index = {}
+    for url, page_content in pages:
+        name = hashlib.sha1(url.encode()).hexdigest()[:16] + '.html'
+        with open(os.path.join(corpus_dir, name), 'wb') as file:
+            file.write(page_content if isinstance(page_content, bytes) else page_content.encode())
+        index[url] = name
+    with open(os.path.join(corpus_dir, 'index.json'), 'w') as file:
+        json.dump({'searches': searches, 'pages': index}, file, indent=1)
+    print(f"Wrote {len(index)} pages to {corpus_dir}")
+
+
+def generate(args):
+    rng = random.Random(args.seed)
+    pages = []
+    for job_keyword in args.position:
+        for location_keyword in args.location:
+            # Pages past the last one are left out so the replayed search ends on an empty page
+            for start in PAGE_STARTS[:args.pages]:
+                pages.append((corpus_url(job_keyword, location_keyword, start),
+                              synthetic_page(rng, args.cards, args.page_kb)))
+    save_corpus(args.corpus, list(itertools.product(args.position, args.location)), pages)
+
+
+def record(args):
+    # Live pages through the scraper's own fetch path, politeness limits included
+    browser = Browser(rate=args.rate)
+    pages = []
+    try:
+        for job_keyword in args.position:
+            for location_keyword in args.location:
+                for start in PAGE_STARTS[:args.pages]:
+                    url = corpus_url(job_keyword, location_keyword, start)
+                    page_content = browser.fetch_page(url)
+                    pages.append((url, page_content))
+                    if not job_card_extractor.cards(parse_page(page_content)):
+                        break
+    finally:
+        browser.close()
+    save_corpus(args.corpus, list(itertools.product(args.position, args.location)), pages)
+
+
+class CorpusFetcher(HttpFetcher):
+    # Replays recorded pages by URL; URLs outside the corpus get an empty result page
+    EMPTY_PAGE = b'<html><body><div id="mosaic-provider-jobcards"></div></body></html>'
+
+    def __init__(self, corpus_dir):
+        with open(os.path.join(corpus_dir, 'index.json')) as file:
+            index = json.load(file)
+        self.searches = [tuple(search) for search in index['searches']]
+        self.pages = {}
+        for url, name in index['pages'].items():
+            with open(os.path.join(corpus_dir, name), 'rb') as file:
+                self.pages[url] = file.read()
+
+    def fetch(self, url):
+        return self.pages.get(url, self.EMPTY_PAGE)
+
+    def close(self):
+        pass
+
+
+class MemoryJobDatabase:
+    # Stand-in for JobDatabase when no Postgres is configured; keeps records in a list
+    def __init__(self):
+        self.records = []
+
+    def load_seen_keys(self, job_keyword, location_keyword):
+        return None, set()
+
+    def claim_unit(self, *unit):
+        return 'claimed', None
+
+    def complete_unit(self, *unit):
+        pass
+
+    def release_unit(self, *unit):
+        pass
+
+    def insert_record(self, record):
+        self.records.append(record)
+
+    def mark_seen(self, *args):
+        pass
+
+    def close(self):
+        pass
+
+
+class PeakRss:
+    # Samples resident memory in the background; each stage reports the highest value seen while it ran
+    def __init__(self, interval=0.005):
+        self.process = psutil.Process()
+        self.interval = interval
+        self.peak = 0
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def sample(self):
+        while self.running:
+            self.peak = max(self.peak, self.process.memory_info().rss)
+            time.sleep(self.interval)
+
+    def reset(self):
+        self.peak = self.process.memory_info().rss
+
+    def stop(self):
+        self.running = False
+        self.thread.join()
+
+
+@contextlib.contextmanager
+def stage(name, results, rss):
+    # Per-job debug logging stays inside the timing, filtered by LOG_LEVEL and LOG_DEBUG_SAMPLE as in a real run
+    metrics = {}
+    rss.reset()
+    started = time.perf_counter()
+    yield metrics
+    metrics['seconds'] = time.perf_counter() - started
+    metrics['peak_rss_mb'] = max(rss.peak, psutil.Process().memory_info().rss) / 1024 / 1024
+    results[name] = metrics
+
+
+def raw_frame(records, rows):
+    # The raw table as cleaning.fetch_data returns it, repeated up to the requested size with distinct job keys
+    df = pd.DataFrame(records, columns=JobDatabase.COLUMNS)
+    copies = max(1, -(-rows // len(df)))
+    df = pd.concat([df] * copies, ignore_index=True).head(rows)
+    df['job_jk'] = df['job_jk'] + '-' + (df.index // len(records)).astype(str)
+    df.insert(0, 'id', range(1, len(df) + 1))
+    df['cleaned'] = False
+    return df
+
+
+def run(args):
+    fetcher = CorpusFetcher(args.corpus)
+    urls = list(fetcher.pages)
+    searches = fetcher.searches
+    print(f"{len(urls)} pages, {len(searches)} searches, "
+          f"{sum(map(len, fetcher.pages.values())) / len(urls) / 1024:.0f} KB average page")
+
+    browser = Browser(rate=0, fetcher='http', sanitize=args.sanitize)
+    browser.http = fetcher
+    rss = PeakRss()
+    results = {}
+
+    with stage('fetch', results, rss) as metrics:
+        pages = [browser.fetch_page(url) for _ in range(args.repeat) for url in urls]
+    metrics['pages_per_second'] = len(pages) / metrics['seconds']
+
+    per_page = []
+    with stage('parse', results, rss) as metrics:
+        doms = []
+        for page_content in pages:
+            started = time.perf_counter()
+            doms.append(parse_page(page_content, sanitize=args.sanitize))
+            per_page.append((time.perf_counter() - started) * 1000)
+    metrics['pages_per_second'] = len(doms) / metrics['seconds']
+    metrics['parse_ms_per_page'] = statistics.mean(per_page)
+    metrics['parse_ms_p95'] = statistics.quantiles(per_page, n=20)[-1] if len(per_page) > 1 else per_page[0]
+
+    with stage('extract', results, rss) as metrics:
+        cards = [job_card_extractor.extract(card) for dom in doms for card in job_card_extractor.cards(dom)]
+    metrics['cards_per_second'] = len(cards) / metrics['seconds']
+    del doms, pages
+
+    db = MemoryJobDatabase()
+    with stage('scrape', results, rss) as metrics:
+        jobs = 0
+        for _ in range(args.repeat):
+            for job_keyword, location_keyword in searches:
+                jobs += scrape_jobs(db, browser, job_keyword, location_keyword, SEARCH_RADIUS)
+    metrics['pages_per_second'] = len(urls) * args.repeat / metrics['seconds']
+    metrics['cards_per_second'] = jobs / metrics['seconds']
+
+    if not db.records:
+        sys.exit("The corpus produced no job records; check it was recorded from search result pages")
+
+    if args.postgres:
+        # Writes into a scratch table so the benchmark never touches scraped data
+        os.environ['DB_TABLE_NAME'] = args.table
+        database = JobDatabase()
+        try:
+            with stage('ingest', results, rss) as metrics:
+                database.insert_records(db.records)
+                database.flush()
+            metrics['rows_per_second'] = len(db.records) / metrics['seconds']
+        finally:
+            with database.conn.cursor() as cur:
+                for suffix in ('', '_scrape_state', '_seen_jobs', '_scrape_units'):
+                    cur.execute(f"DROP TABLE IF EXISTS {args.table}{suffix}")
+            database.conn.commit()
+            database.conn.close()
+
+    df = raw_frame(db.records, args.clean_rows)
+    with stage('clean', results, rss) as metrics:
+        processed = process_data(df, None, None)
+    metrics['rows_per_second'] = len(processed) / metrics['seconds']
+    rss.stop()
+
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'recorded_at': datetime.now().isoformat(), 'stages': results}, file, indent=1)
+    if args.baseline:
+        sys.exit(compare(results, args.baseline, args.tolerance))
+
+
+def report(results):
+    for name, metrics in results.items():
+        rates = '  '.join(f"{key.replace('_per_second', '/s')} {value:12,.1f}" for key, value in metrics.items()
+                          if key.endswith('_per_second'))
+        parse = f"  parse {metrics['parse_ms_per_page']:.2f} ms/page (p95 {metrics['parse_ms_p95']:.2f})" \
+            if 'parse_ms_per_page' in metrics else ''
+        print(f"{name:<8} {metrics['seconds']:8.2f} s  peak RSS {metrics['peak_rss_mb']:7.1f} MB  {rates}{parse}")
+
+
+def compare(results, baseline_path, tolerance):
+    # Throughput below baseline by more than the tolerance is a regression
+    with open(baseline_path) as file:
+        baseline = json.load(file)['stages']
+    regressions = []
+    for name, metrics in results.items():
+        # Stages over in a few milliseconds are dominated by timer noise
+        if metrics['seconds'] < 0.05:
+            continue
+        for key, value in metrics.items():
+            expected = baseline.get(name, {}).get(key)
+            if key.endswith('_per_second') and expected and value < expected * (1 - tolerance):
+                regressions.append(f"{name} {key}: {value:,.1f} vs baseline {expected:,.1f}")
+    for regression in regressions:
+        print(f"Regression: {regression}")
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a corpus of search pages through the scrape and clean stages.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    for name, help_text in (('generate', 'Write a synthetic corpus'), ('record', 'Record live search pages')):
+        subparser = subparsers.add_parser(name, help=help_text)
+        subparser.add_argument('corpus', help='Corpus directory')
+        subparser.add_argument('--position', nargs='+', default=['Software', 'Data+Analyst'])
+        subparser.add_argument('--location', nargs='+', default=['Seattle', 'Austin'])
+        subparser.add_argument('--pages', type=int, default=5, help='Result pages per search')
+    subparsers.choices['generate'].add_argument('--cards', type=int, default=15, help='Job cards per page')
+    subparsers.choices['generate'].add_argument('--page-kb', type=int, default=300, help='Approximate page size')
+    subparsers.choices['generate'].add_argument('--seed', type=int, default=0)
+    subparsers.choices['record'].add_argument('--rate', type=float, default=0.2, help='Page loads per second')
+
+    run_parser = subparsers.add_parser('run', help='Benchmark every stage against a corpus')
+    run_parser.add_argument('corpus', help='Corpus directory')
+    run_parser.add_argument('--repeat', type=int, default=3, help='Passes over the corpus for fetch, parse and scrape')
+    run_parser.add_argument('--clean-rows', type=int, default=100_000, help='Rows fed to process_data')
+    run_parser.add_argument('--sanitize', action='store_true', help='Parse with the sanitizing parser')
+    run_parser.add_argument('--postgres', action='store_true',
+                            help='Also time inserts into Postgres using the DB_* settings')
+    run_parser.add_argument('--table', default='bench_raw_jobs', help='Scratch table for the ingest stage')
+    run_parser.add_argument('--output', help='Write the results as JSON, e.g. to use as a baseline')
+    run_parser.add_argument('--baseline', help='Results JSON to compare against; exits 1 on a regression')
+    run_parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed throughput drop against the baseline')
+    args = parser.parse_args()
+
+    {'generate': generate, 'record': record, 'run': run}[args.command](args)
+
+
+if __name__ == "__main__":
+    main()
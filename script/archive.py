@@ -0,0 +1,287 @@
+import argparse
+import gzip
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from urllib.parse import unquote, urlparse
+from dotenv import load_dotenv
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+import metrics
+from logging_setup import setup_logging
+
+logger = logging.getLogger('archive')
+
+ARCHIVE_PAGES_TOTAL = metrics.counter('jobspy_archive_pages_total',
+                                      'Fetched pages archived, by whether their content was already stored', ['result'])
+ARCHIVE_BYTES_TOTAL = metrics.counter('jobspy_archive_bytes_total', 'Bytes of archived page content', ['stage'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS objects (
+    digest TEXT PRIMARY KEY,
+    codec TEXT NOT NULL,
+    raw_size INTEGER NOT NULL,
+    stored_size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    url TEXT NOT NULL,
+    digest TEXT NOT NULL REFERENCES objects (digest),
+    job_keyword TEXT,
+    location_keyword TEXT,
+    search_radius INTEGER,
+    page_no INTEGER,
+    fetched_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pages_search_idx ON pages (job_keyword, location_keyword, page_no, fetched_at);
+CREATE INDEX IF NOT EXISTS pages_fetched_idx ON pages (fetched_at);
+"""
+
+CODEC_SUFFIXES = {'zstd': '.zst', 'gzip': '.gz'}
+
+def search_params(url):
+    # Keywords keep their '+' the way scrape_jobs put them into the URL, so the index matches job_keyword
+    params = {}
+    for part in urlparse(url).query.split('&'):
+        name, _, value = part.partition('=')
+        params[name] = unquote(value)
+    return params
+
+def to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+def object_path(root, digest, codec):
+    # Two-character fan-out keeps directories small once the archive holds a few hundred thousand pages
+    return os.path.join(root, 'objects', digest[:2], digest + CODEC_SUFFIXES[codec])
+
+def compress(data, codec, level):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    return gzip.compress(data, compresslevel=level)
+
+def decompress(blob, codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Page was archived with zstd; install zstandard to read it")
+        return zstandard.ZstdDecompressor().decompress(blob)
+    return gzip.decompress(blob)
+
+def read_object(root, digest, codec):
+    with open(object_path(root, digest, codec), 'rb') as file:
+        return decompress(file.read(), codec)
+
+class PageArchive:
+    # Content-addressed store of fetched pages: each distinct page body is compressed once under its SHA-256,
+    # and every fetch is indexed by search keyword, location, page and time in SQLite
+    def __init__(self, root=None, codec=None, level=None):
+        self.root = root or os.getenv('SCRAPE_ARCHIVE_DIR')
+        os.makedirs(os.path.join(self.root, 'objects'), exist_ok=True)
+        self.codec = codec or os.getenv('SCRAPE_ARCHIVE_CODEC') or ('zstd' if zstandard is not None else 'gzip')
+        if self.codec == 'zstd' and zstandard is None:
+            logger.warning("zstandard is not installed, archiving pages with gzip.")
+            self.codec = 'gzip'
+        default_level = 10 if self.codec == 'zstd' else 6
+        self.level = int(level or os.getenv('SCRAPE_ARCHIVE_LEVEL', default_level))
+        self.conn = sqlite3.connect(os.path.join(self.root, 'index.sqlite3'), timeout=30, isolation_level=None)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(SCHEMA)
+
+    def store(self, url, page_content, fetched_at=None):
+        # Never fails the scrape: a page that cannot be archived is only logged
+        try:
+            data = page_content.encode('utf-8') if isinstance(page_content, str) else page_content
+            digest = hashlib.sha256(data).hexdigest()
+            row = self.conn.execute('SELECT codec FROM objects WHERE digest = ?', (digest,)).fetchone()
+            if row is None:
+                blob = compress(data, self.codec, self.level)
+                path = object_path(self.root, digest, self.codec)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                # Workers may store the same page at once; the rename makes whichever finishes last harmless
+                temporary = f"{path}.{os.getpid()}.tmp"
+                with open(temporary, 'wb') as file:
+                    file.write(blob)
+                os.replace(temporary, path)
+                self.conn.execute('INSERT OR IGNORE INTO objects (digest, codec, raw_size, stored_size) '
+                                  'VALUES (?, ?, ?, ?)', (digest, self.codec, len(data), len(blob)))
+                ARCHIVE_PAGES_TOTAL.inc(result='new')
+                ARCHIVE_BYTES_TOTAL.inc(len(blob), stage='stored')
+            else:
+                ARCHIVE_PAGES_TOTAL.inc(result='duplicate')
+            ARCHIVE_BYTES_TOTAL.inc(len(data), stage='raw')
+            params = search_params(url)
+            self.conn.execute(
+                'INSERT INTO pages (url, digest, job_keyword, location_keyword, search_radius, page_no, fetched_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (url, digest, params.get('q'), params.get('l'), to_int(params.get('radius')),
+                 to_int(params.get('start')), fetched_at or time.time())
+            )
+            return digest
+        except Exception as e:
+            ARCHIVE_PAGES_TOTAL.inc(result='error')
+            logger.warning(f"Could not archive page {url}: {e}")
+            return None
+
+    def load(self, digest):
+        row = self.conn.execute('SELECT codec FROM objects WHERE digest = ?', (digest,)).fetchone()
+        if row is None:
+            raise KeyError(digest)
+        return read_object(self.root, digest, row['codec'])
+
+    def pages(self, job_keywords=None, location_keywords=None, since=None, until=None):
+        conditions, params = [], []
+        if job_keywords:
+            conditions.append(f"job_keyword IN ({', '.join('?' * len(job_keywords))})")
+            params.extend(job_keywords)
+        if location_keywords:
+            conditions.append(f"location_keyword IN ({', '.join('?' * len(location_keywords))})")
+            params.extend(location_keywords)
+        if since is not None:
+            conditions.append('fetched_at >= ?')
+            params.append(since)
+        if until is not None:
+            conditions.append('fetched_at < ?')
+            params.append(until)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        return self.conn.execute(
+            'SELECT pages.*, objects.codec FROM pages JOIN objects USING (digest) '
+            f'{where} ORDER BY fetched_at', params
+        ).fetchall()
+
+    def stats(self):
+        pages, raw_bytes = self.conn.execute('SELECT COUNT(*), COALESCE(SUM(raw_size), 0) '
+                                             'FROM pages JOIN objects USING (digest)').fetchone()
+        objects, unique_bytes, stored_bytes = self.conn.execute(
+            'SELECT COUNT(*), COALESCE(SUM(raw_size), 0), COALESCE(SUM(stored_size), 0) FROM objects'
+        ).fetchone()
+        return {'pages': pages, 'objects': objects, 'raw_bytes': raw_bytes, 'unique_bytes': unique_bytes,
+                'stored_bytes': stored_bytes}
+
+    def close(self):
+        self.conn.close()
+
+def extract_records(task):
+    # Runs in a pool worker: parses one archived page once and builds a record for every search that fetched it.
+    # job_scrapping imports this module for its archive hook, so it is only imported where replay needs it
+    import job_scrapping
+    root, digest, codec, searches, sanitize = task
+    dom = job_scrapping.parse_page(read_object(root, digest, codec), sanitize=sanitize)
+    if dom is None:
+        return digest, 0, []
+    cards = job_scrapping.extract_cards(dom)
+    records = [job_scrapping.job_record(card, job_keyword, datetime.fromtimestamp(fetched_at))
+               for job_keyword, fetched_at in searches for card in cards]
+    return digest, len(cards), records
+
+def extract_records_safely(task):
+    try:
+        return extract_records(task)
+    except Exception as e:
+        logger.error(f"Could not replay archived page {task[1]}: {e}")
+        return task[1], 0, None
+
+def replay(archive, pages, workers=None, db=None, sanitize=False):
+    # Identical page bodies are parsed once however many times, or under however many searches, they were fetched
+    searches = defaultdict(dict)
+    codecs = {}
+    for page in pages:
+        first_seen = searches[page['digest']]
+        if page['job_keyword'] not in first_seen or page['fetched_at'] < first_seen[page['job_keyword']]:
+            first_seen[page['job_keyword']] = page['fetched_at']
+        codecs[page['digest']] = page['codec']
+    tasks = [(archive.root, digest, codecs[digest], sorted(by_keyword.items()), sanitize)
+             for digest, by_keyword in searches.items()]
+
+    summary = {'pages': len(pages), 'objects': len(tasks), 'cards': 0, 'records': 0, 'failed': 0}
+    # Loaded before the pool starts so forked workers inherit it instead of each importing it again
+    import job_scrapping
+    workers = workers or os.cpu_count() or 1
+    # Chunks amortize the round trip to the workers while leaving enough of them to keep every core busy
+    chunksize = max(1, min(32, len(tasks) // (4 * workers)))
+    started = time.monotonic()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for digest, cards, records in executor.map(extract_records_safely, tasks, chunksize=chunksize):
+            if records is None:
+                summary['failed'] += 1
+                continue
+            summary['cards'] += cards
+            summary['records'] += len(records)
+            if db is not None:
+                db.insert_records(records)
+    if db is not None:
+        db.flush()
+    summary['elapsed'] = time.monotonic() - started
+    return summary
+
+def parse_time(value):
+    return datetime.fromisoformat(value).timestamp() if value else None
+
+def main():
+    parser = argparse.ArgumentParser(description='Archive of fetched search result pages.')
+    parser.add_argument('--archive', default=os.getenv('SCRAPE_ARCHIVE_DIR'),
+                        help='Archive directory (default SCRAPE_ARCHIVE_DIR)')
+    subcommands = parser.add_subparsers(dest='command', required=True)
+
+    subcommands.add_parser('stats', help='Show how many pages are archived and how much space they take')
+
+    replay_parser = subcommands.add_parser('replay', help='Re-run job extraction over archived pages')
+    replay_parser.add_argument('--position', nargs='+', help='Only replay pages fetched for these position(s)')
+    replay_parser.add_argument('--location', nargs='+', help='Only replay pages fetched for these location(s)')
+    replay_parser.add_argument('--since', help='Only replay pages fetched at or after this ISO date/time')
+    replay_parser.add_argument('--until', help='Only replay pages fetched before this ISO date/time')
+    replay_parser.add_argument('--workers', type=int, help='Extraction processes (default: one per core)')
+    replay_parser.add_argument('--sanitize', action='store_true',
+                               help='Strip scripts, styles and comments while parsing pages')
+    replay_parser.add_argument('--dry-run', action='store_true',
+                               help='Extract and count jobs without writing them to the database')
+    replay_parser.add_argument('--update', action='store_true',
+                               help='Overwrite the card fields of jobs that are already stored with the re-extracted '
+                                    'values and queue the changed ones for cleaning again (by default stored jobs '
+                                    'only gain keywords)')
+    args = parser.parse_args()
+
+    if not args.archive:
+        parser.error('--archive or SCRAPE_ARCHIVE_DIR is required')
+    archive = PageArchive(args.archive)
+    try:
+        if args.command == 'stats':
+            stats = archive.stats()
+            ratio = stats['raw_bytes'] / stats['stored_bytes'] if stats['stored_bytes'] else 0
+            logger.info(f"{stats['pages']} pages archived as {stats['objects']} distinct objects: "
+                        f"{stats['raw_bytes'] / 2**20:.1f} MiB fetched, {stats['stored_bytes'] / 2**20:.1f} MiB "
+                        f"on disk ({ratio:.1f}x)")
+            return
+
+        pages = archive.pages(args.position, args.location, parse_time(args.since), parse_time(args.until))
+        logger.info(f"Replaying {len(pages)} archived pages.")
+        db = None
+        if not args.dry_run:
+            from job_scrapping import JobDatabase
+            db = JobDatabase(overwrite=args.update)
+        try:
+            summary = replay(archive, pages, workers=args.workers, db=db, sanitize=args.sanitize)
+        finally:
+            if db is not None:
+                db.close()
+        logger.info(f"Replay summary: {summary['pages']} pages ({summary['objects']} distinct) gave "
+                    f"{summary['cards']} job cards and {summary['records']} records, {summary['failed']} failed, "
+                    f"in {summary['elapsed']:.1f}s.")
+    finally:
+        archive.close()
+
+if __name__ == '__main__':
+    load_dotenv()
+    setup_logging()
+    main()
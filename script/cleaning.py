@@ -1,22 +1,43 @@
 # %%
 import pandas as pd
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, inspect, text
 import numpy as np
 import googlemaps
 import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import timedelta
 from dotenv import load_dotenv
 from sqlalchemy import create_engine
 import os
 import requests
+from requests.adapters import HTTPAdapter
 import time 
-from bs4 import BeautifulSoup
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from lxml import etree as et
 from lxml import html
 import telebot
 from datetime import datetime
+from job_scrapping import BrowserPool, RateLimiter, parse_page
+from logging_setup import flush_logging, setup_logging
+import argparse
+import io
+import math
+import random
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import metrics
+
+logger = logging.getLogger('cleaning')
+
+FETCH_SECONDS = metrics.histogram('jobspy_cleaning_fetch_seconds', 'Time to read one batch of raw rows', ['mode'])
+PROCESS_SECONDS = metrics.histogram('jobspy_cleaning_process_seconds', 'Time to clean one batch of rows')
+APPEND_SECONDS = metrics.histogram('jobspy_cleaning_append_seconds', 'Time to write one batch of cleaned rows',
+                                   ['method'])
+ROWS_TOTAL = metrics.counter('jobspy_cleaning_rows_total', 'Rows by cleaning stage', ['stage'])
+GEOCODE_LOOKUPS_TOTAL = metrics.counter('jobspy_geocode_lookups_total', 'Distinct locations by where they were resolved',
+                                        ['source'])
+GEOCODE_REQUEST_SECONDS = metrics.histogram('jobspy_geocode_request_seconds', 'Time of one geocoding API request')
+GEOCODE_RETRIES_TOTAL = metrics.counter('jobspy_geocode_retries_total', 'Geocoding requests retried after an error')
+ERRORS_TOTAL = metrics.counter('jobspy_errors_total', 'Errors by pipeline stage', ['stage'])
 
 class TelebotNotifier:
     def __init__(self):
@@ -28,8 +49,11 @@ class TelebotNotifier:
         try:
             self.bot.send_message(self.chat_id, message)
         except Exception as e:
-            print(f"Failed to send notification. Error: {e}")
+            logger.error(f"Failed to send notification. Error: {e}")
             
+# Marker written for missing values in COPY input
+COPY_NULL = '\\N'
+
 ## DB connection Class
 class DatabaseConnection:
     def __init__(self):
@@ -60,31 +84,129 @@ class DatabaseConnection:
             query += ';'  # Finalize the query with a semicolon
 
             # Execute the query and fetch the data
-            df = pd.read_sql_query(query, con=self.engine)
+            with FETCH_SECONDS.time(mode='batch'):
+                df = pd.read_sql_query(query, con=self.engine)
+            ROWS_TOTAL.inc(len(df), stage='fetched')
 
             if len(df) == 0:
                 raise Exception("No data to be cleaned")
             else:
-                print(f"Number of rows fetched: {len(df)}")  # Debugging line
+                logger.info(f"Number of rows fetched: {len(df)}")  # Debugging line
 
-            return df
+            return self.full_descriptions(df, table_name)
         except Exception as e:
-            print(f"Error: {e}")
+            logger.error(f"Error: {e}")
             raise e
 
-    def update_data(self, df):
-        with self.engine.connect() as conn:
-            with conn.begin():
-                ids_to_update = ','.join(map(str, df[df['cleaned'] == False]['id'].tolist()))
-                update_statement = text(f"""
-                    UPDATE {os.getenv('DB_TABLE_NAME')}
-                    SET cleaned = TRUE
-                    WHERE id = ANY(SELECT unnest(string_to_array(:ids, ',')::bigint[]))
-                """)
-                conn.execute(update_statement, {'ids': ids_to_update})
-
-    def append_data(self, df, table_name):
-        df.to_sql(table_name, self.engine, if_exists='append', index=False)
+    def create_indexes(self, table_name):
+        # Partial index: finding uncleaned rows stays an index lookup however much of the table is cleaned
+        with self.engine.begin() as conn:
+            conn.execute(text(f'CREATE INDEX IF NOT EXISTS {table_name}_uncleaned_idx '
+                              f'ON {table_name} (id) WHERE cleaned = FALSE'))
+            # Output rows are looked up by job key when a posting is cleaned again
+            if inspect(conn).has_table('processed_jobs'):
+                conn.execute(text('CREATE INDEX IF NOT EXISTS processed_jobs_job_jk_idx ON processed_jobs (job_jk)'))
+
+    def claim_batch(self, conn, table_name, batch_size, after_id=0):
+        # Claimed rows stay locked until the caller's transaction ends; rows other cleaners hold are skipped
+        query = text(f'SELECT * FROM {table_name} WHERE cleaned = FALSE AND id > :after_id '
+                     'ORDER BY id LIMIT :batch_size FOR UPDATE SKIP LOCKED')
+        with FETCH_SECONDS.time(mode='claim'):
+            df = pd.read_sql_query(query, con=conn, params={'after_id': after_id, 'batch_size': batch_size})
+        ROWS_TOTAL.inc(len(df), stage='fetched')
+        logger.info(f"Number of rows claimed: {len(df)}")  # Debugging line
+        return self.full_descriptions(df, table_name, conn)
+
+    def iter_uncleaned(self, table_name, chunk_size):
+        # Server-side cursor: rows arrive chunk_size at a time, however large the backlog is
+        query = text(f'SELECT * FROM {table_name} WHERE cleaned = FALSE ORDER BY id')
+        with self.engine.connect().execution_options(stream_results=True, max_row_buffer=chunk_size) as conn:
+            chunks = pd.read_sql_query(query, con=conn, chunksize=chunk_size)
+            while True:
+                with FETCH_SECONDS.time(mode='stream'):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    return
+                ROWS_TOTAL.inc(len(chunk), stage='fetched')
+                logger.info(f"Number of rows fetched: {len(chunk)}")  # Debugging line
+                # Looked up on a separate connection; this one is still streaming the chunks
+                yield self.full_descriptions(chunk, table_name)
+
+    def full_descriptions(self, df, table_name, conn=None):
+        # Swaps the search card snippet for the full description enrich_descriptions.py fetched, where there is one
+        if conn is None:
+            with self.engine.connect() as conn:
+                return self.full_descriptions(df, table_name, conn)
+        descriptions_table = f'{table_name}_descriptions'
+        keys = df['job_jk'].dropna().unique().tolist() if 'job_jk' in df else []
+        if not keys or not inspect(conn).has_table(descriptions_table):
+            return df
+        query = text(f"SELECT job_jk, description FROM {descriptions_table} "
+                     "WHERE status = 'done' AND job_jk = ANY(:keys)")
+        descriptions = pd.read_sql_query(query, con=conn, params={'keys': keys})
+        if not descriptions.empty:
+            full_text = df['job_jk'].map(descriptions.set_index('job_jk')['description'])
+            df['job_description'] = full_text.fillna(df['job_description'])
+        ROWS_TOTAL.inc(len(descriptions), stage='described')
+        return df
+
+    def update_data(self, df, conn=None):
+        # Runs in the caller's transaction when a connection is passed
+        if conn is None:
+            with self.engine.begin() as conn:
+                return self.update_data(df, conn)
+        # The ids travel as one typed array parameter rather than a string Postgres has to split
+        ids_to_update = [int(row_id) for row_id in df.loc[df['cleaned'] == False, 'id']]
+        update_statement = text(f"""
+            UPDATE {os.getenv('DB_TABLE_NAME')}
+            SET cleaned = TRUE
+            WHERE id = ANY(CAST(:ids AS bigint[]))
+        """)
+        conn.execute(update_statement, {'ids': ids_to_update})
+        ROWS_TOTAL.inc(len(ids_to_update), stage='marked')
+
+    def append_data(self, df, table_name, conn=None):
+        if conn is None:
+            with self.engine.begin() as conn:
+                return self.append_data(df, table_name, conn)
+        if not inspect(conn).has_table(table_name):
+            # First run: let pandas create the table with its usual type mapping
+            with APPEND_SECONDS.time(method='to_sql'):
+                df.to_sql(table_name, conn, if_exists='append', index=False)
+        else:
+            with APPEND_SECONDS.time(method='copy'):
+                self.copy_data(df, table_name, conn)
+        ROWS_TOTAL.inc(len(df), stage='appended')
+
+    def delete_processed(self, df, table_name, conn):
+        # Postings refreshed by `archive.py replay --update` come back uncleaned; their earlier output row is replaced
+        keys = df['job_jk'].dropna().unique().tolist() if 'job_jk' in df else []
+        if not keys or not inspect(conn).has_table(table_name):
+            return
+        result = conn.execute(text(f'DELETE FROM {table_name} WHERE job_jk = ANY(:keys)'), {'keys': keys})
+        ROWS_TOTAL.inc(result.rowcount, stage='replaced')
+
+    def copy_data(self, df, table_name, conn):
+        # Stream the frame through COPY as CSV: nullable Int64 and NaN become NULL,
+        # dates and timestamps are written in ISO format which Postgres parses for DATE/TIMESTAMPTZ columns
+        if df.empty:
+            return
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False, na_rep=COPY_NULL)
+        buffer.seek(0)
+        columns = ', '.join(f'"{column}"' for column in df.columns)
+        with conn.connection.cursor() as cursor:
+            cursor.copy_expert(f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')", buffer)
+
+    def commit_chunk(self, raw_df, processed_df, table_name, conn=None):
+        # Output rows and the cleaned flag of their source rows commit together,
+        # so a crash cannot leave rows marked cleaned without having been written
+        if conn is None:
+            with self.engine.begin() as conn:
+                return self.commit_chunk(raw_df, processed_df, table_name, conn)
+        self.delete_processed(processed_df, table_name, conn=conn)
+        self.append_data(processed_df, table_name, conn=conn)
+        self.update_data(raw_df, conn=conn)
     
     def trigger_dod(self):
         query = f'SELECT clean_processed_jobs();'
@@ -93,80 +215,194 @@ class DatabaseConnection:
 
 ## Geocoder class
 class Geocoder:
-    def __init__(self):
-        self.api_key = os.getenv('GOOGLE_API_KEY')
-        self.gmaps_client = googlemaps.Client(key=self.api_key)
-        print("Geocoder initialized with Google API Key.")
+    CACHE_TABLE = 'geocode_cache'
 
-    def geocode_location(self, location, attempt=1, max_attempts=3):
-        print(f"Attempting to geocode location: {location}, Attempt: {attempt}")
+    def __init__(self, engine=None, cache_size=10000):
+        self.api_key = os.getenv('GOOGLE_API_KEY')
+        # Concurrent lookups share one QPS budget; failed requests back off exponentially
+        self.workers = int(os.getenv('GEOCODE_WORKERS', 8))
+        self.qps = float(os.getenv('GEOCODE_QPS', 10))
+        self.max_attempts = int(os.getenv('GEOCODE_MAX_ATTEMPTS', 5))
+        self.backoff = float(os.getenv('GEOCODE_BACKOFF_SECONDS', 0.5))
+        self.rate_limiter = RateLimiter(self.qps, burst=max(1, int(self.qps)))
+        # GEOCODE_BASE_URL points the client at a stand-in server (see benchmarks/bench_geocode.py)
+        client_options = {'base_url': os.getenv('GEOCODE_BASE_URL')} if os.getenv('GEOCODE_BASE_URL') else {}
+        # requests keeps 10 connections per host by default; every lookup thread needs its own
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.workers, pool_maxsize=self.workers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        self.gmaps_client = googlemaps.Client(
+            key=self.api_key,
+            queries_per_second=max(1, math.ceil(self.qps)) if self.qps > 0 else 60,
+            retry_over_query_limit=False,
+            requests_session=session,
+            **client_options
+        )
+        logger.info("Geocoder initialized with Google API Key.")
+        # In-process LRU in front of a persistent table shared by every run and cleaner
+        self.engine = engine
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.ttl = timedelta(days=int(os.getenv('GEOCODE_CACHE_TTL_DAYS', 180)))
+        # Places Google could not resolve are retried sooner than resolved ones are refreshed
+        self.negative_ttl = timedelta(days=int(os.getenv('GEOCODE_NEGATIVE_TTL_DAYS', 7)))
+        if self.engine is not None:
+            self.create_cache_table()
+
+    def create_cache_table(self):
+        with self.engine.begin() as conn:
+            conn.execute(text(f"""
+                CREATE TABLE IF NOT EXISTS {self.CACHE_TABLE} (
+                    location_key TEXT PRIMARY KEY,
+                    latitude DOUBLE PRECISION,
+                    longitude DOUBLE PRECISION,
+                    updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+                )
+            """))
+
+    @staticmethod
+    def normalize_location(location):
+        return ' '.join(str(location).lower().split())
+
+    def remember(self, key, coords):
+        self.cache[key] = coords
+        self.cache.move_to_end(key)
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def lookup_cached(self, keys):
+        found = {}
+        missing = []
+        for key in keys:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                found[key] = self.cache[key]
+            else:
+                missing.append(key)
+        GEOCODE_LOOKUPS_TOTAL.inc(len(found), source='memory')
+        if missing and self.engine is not None:
+            query = text(f"""
+                SELECT location_key, latitude, longitude FROM {self.CACHE_TABLE}
+                WHERE location_key = ANY(CAST(:keys AS text[]))
+                AND updated_at >= now() - CASE WHEN latitude IS NULL THEN :negative_ttl ELSE :ttl END
+            """)
+            with self.engine.connect() as conn:
+                rows = conn.execute(query, {'keys': missing, 'ttl': self.ttl, 'negative_ttl': self.negative_ttl})
+                for key, latitude, longitude in rows:
+                    found[key] = (latitude, longitude)
+                    self.remember(key, (latitude, longitude))
+                    GEOCODE_LOOKUPS_TOTAL.inc(source='database')
+        return found
+
+    def store(self, results):
+        for key, coords in results.items():
+            self.remember(key, coords)
+        if not results or self.engine is None:
+            return
+        upsert = text(f"""
+            INSERT INTO {self.CACHE_TABLE} (location_key, latitude, longitude, updated_at)
+            VALUES (:key, :latitude, :longitude, now())
+            ON CONFLICT (location_key) DO UPDATE
+            SET latitude = EXCLUDED.latitude, longitude = EXCLUDED.longitude, updated_at = EXCLUDED.updated_at
+        """)
+        with self.engine.begin() as conn:
+            conn.execute(upsert, [{'key': key, 'latitude': latitude, 'longitude': longitude}
+                                  for key, (latitude, longitude) in results.items()])
+
+    def request_location(self, location):
+        # Returns (lat, lng), (None, None) when Google has no result, or None when the request failed
+        for attempt in range(1, self.max_attempts + 1):
+            self.rate_limiter.acquire()
+            logger.debug("Attempting to geocode location: %s, Attempt: %d", location, attempt)
+            try:
+                with GEOCODE_REQUEST_SECONDS.time():
+                    geocode_result = self.gmaps_client.geocode(location)
+                if geocode_result:
+                    latitude = geocode_result[0]['geometry']['location']['lat']
+                    longitude = geocode_result[0]['geometry']['location']['lng']
+                    logger.debug("Geocoded location: %s, Latitude: %s, Longitude: %s", location, latitude, longitude)
+                    return latitude, longitude
+                else:
+                    logger.info(f"No geocode results for location: {location}")
+                    return None, None
+            except googlemaps.exceptions.HTTPError as e:
+                ERRORS_TOTAL.inc(stage='geocode')
+                logger.error(f"HTTP error: {e}")
+                return None
+            except (googlemaps.exceptions.Timeout, googlemaps.exceptions.TransportError,
+                    googlemaps.exceptions._OverQueryLimit) as e:
+                if attempt == self.max_attempts:
+                    ERRORS_TOTAL.inc(stage='geocode')
+                    logger.error("Maximum attempts reached. Geocoding failed.")
+                    return None
+                GEOCODE_RETRIES_TOTAL.inc()
+                # Exponential backoff with jitter so parallel workers do not retry in lockstep
+                delay = self.backoff * 2 ** (attempt - 1) * random.uniform(1, 1.5)
+                logger.warning(f"Retryable error ({type(e).__name__}: {e}). Retrying in {delay:.1f}s...")
+                time.sleep(delay)
+            except googlemaps.exceptions.ApiError as e:
+                ERRORS_TOTAL.inc(stage='geocode')
+                logger.error(f"API error: {e}")
+                return None
+            except Exception as e:
+                ERRORS_TOTAL.inc(stage='geocode')
+                logger.error(f"Unexpected error: {e}")
+                return None
+        return None
 
-        if location == 'NULL' or 'remote' in location.lower():
-            print(f"Invalid location: {location}")
-            return None, None
+    @staticmethod
+    def is_geocodable(location):
+        return isinstance(location, str) and location != 'NULL' and 'remote' not in location.lower()
 
-        try:
-            geocode_result = self.gmaps_client.geocode(location)
-            if geocode_result:
-                latitude = geocode_result[0]['geometry']['location']['lat']
-                longitude = geocode_result[0]['geometry']['location']['lng']
-                print(f"Geocoded location: {location}, Latitude: {latitude}, Longitude: {longitude}")
-                return latitude, longitude
-            else:
-                print(f"No geocode results for location: {location}")
-                return None, None
-        except googlemaps.exceptions.Timeout:
-            print("Request timeout. Retrying...")
-            if attempt < max_attempts:
-                time.sleep(1)
-                return self.geocode_location(location, attempt + 1)
-            else:
-                print("Maximum attempts reached. Geocoding failed.")
-                return None, None
-        except googlemaps.exceptions.ApiError as e:
-            print(f"API error: {e}")
-            return None, None
-        except googlemaps.exceptions.HTTPError as e:
-            print(f"HTTP error: {e}")
-            return None, None
-        except googlemaps.exceptions.TransportError as e:
-            print(f"Transport error: {e}")
-            return None, None
-        except Exception as e:
-            print(f"Unexpected error: {e}")
+    def geocode_location(self, location):
+        if not self.is_geocodable(location):
+            logger.debug("Invalid location: %s", location)
             return None, None
+        return self.geocode_locations([location])[self.normalize_location(location)]
+
+    def geocode_locations(self, locations):
+        # Returns {normalized key: (lat, lng)}; only keys missing from both cache tiers reach the API
+        originals = {}
+        for location in locations:
+            originals.setdefault(self.normalize_location(location), location)
+        results = self.lookup_cached(list(originals))
+        cached = len(results)
+        fetched = {}
+        missing = list(originals.keys() - results.keys())
+        with ThreadPoolExecutor(max_workers=max(1, self.workers)) as pool:
+            for key, coords in zip(missing, pool.map(self.request_location, [originals[key] for key in missing])):
+                # Failed requests are not cached so the next run retries them
+                if coords is not None:
+                    fetched[key] = coords
+                results[key] = coords or (None, None)
+        GEOCODE_LOOKUPS_TOTAL.inc(len(fetched), source='api')
+        self.store(fetched)
+        logger.info(f"Geocoded {len(originals)} distinct locations, {cached} from cache.")
+        return results
+
+    def geocode_column(self, locations):
+        # Each distinct place is resolved once, then the coordinates are broadcast back to the rows
+        codes, uniques = pd.factorize(locations)
+        valid = [location for location in uniques if self.is_geocodable(location)]
+        results = self.geocode_locations(valid)
+        coords = [results[self.normalize_location(location)] if self.is_geocodable(location) else (None, None)
+                  for location in uniques] + [(None, None)]
+        latitudes = np.array([latitude for latitude, _ in coords], dtype=float)[codes]
+        longitudes = np.array([longitude for _, longitude in coords], dtype=float)[codes]
+        return pd.DataFrame({'latitude': latitudes, 'longitude': longitudes}, index=locations.index)
 
 class Browser:
     def __init__(self):
-        self.browser = self.get_browser()
-        
-
-    def get_browser(self):
-        chrome_options = Options()
-        chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--window-size=3840,2160")  # Specify window size
-        chrome_options.add_argument("--disable-gpu")  # This option is often recommended for headless
-        chrome_options.add_argument("--no-sandbox")
-        chrome_options.add_argument("--disable-dev-shm-usage")
-
-        # Mimic a user-agent
-        chrome_options.add_argument("--user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36")
-        # chrome_options.page_load_strategy = 'normal'
-        # driver = Service('/usr/local/bin/chromedriver')
-        browser = webdriver.Chrome(options=chrome_options)
-        # browser.get("https://www.indeed.com/")
-        return browser
+        # Chrome only starts when a page is actually requested; cleaning runs that never fetch stay browser-free
+        self.pool = BrowserPool(size=1, headless=True, window_size='3840,2160', warmup=False)
 
     def get_dom(self, url):
-        self.browser.get(url)
-        page_content = self.browser.page_source
-        product_soup = BeautifulSoup(page_content, 'html.parser')
-        dom = et.HTML(str(product_soup))
-        return dom
+        page_content = self.pool.fetch(url)
+        return parse_page(page_content)
 
     def scrape_job_description(self, url):
-        self.browser.get(url)
-        html_content = self.browser.page_source
+        html_content = self.pool.fetch(url)
         tree = html.fromstring(html_content)
         job_description_div = tree.xpath('//div[@id="jobDescriptionText"]')[0]
     
@@ -182,7 +418,7 @@ class Browser:
         return job_description
 
     def close(self):
-        self.browser.close()
+        self.pool.close()
 
 #%%
 #  Other functions
@@ -203,8 +439,52 @@ def calculate_post_date(row):
         # If the format is unexpected, return None or some default value
         return None
 
+# Little-endian EWKB point carrying an SRID: byte order, geometry type with the SRID flag, SRID, x, y
+EWKB_POINT = np.dtype([('byte_order', 'u1'), ('type', '<u4'), ('srid', '<u4'), ('x', '<f8'), ('y', '<f8')])
+
+def build_geometry(latitudes, longitudes, geometry_format='ewkt'):
+    # Vectorized SRID=4326 points for a whole column; rows without coordinates get None
+    latitudes = np.asarray(latitudes, dtype=float)
+    longitudes = np.asarray(longitudes, dtype=float)
+    valid = ~(np.isnan(latitudes) | np.isnan(longitudes))
+    geometry = np.full(len(latitudes), None, dtype=object)
+    if geometry_format == 'ewkb':
+        points = np.zeros(int(valid.sum()), dtype=EWKB_POINT)
+        points['byte_order'] = 1
+        points['type'] = 0x20000001
+        points['srid'] = 4326
+        points['x'] = longitudes[valid]
+        points['y'] = latitudes[valid]
+        # Hex-encode the packed records in one go, then split into one hex string per point
+        hexed = points.tobytes().hex().upper().encode()
+        geometry[valid] = np.frombuffer(hexed, dtype=f'S{EWKB_POINT.itemsize * 2}').astype(str)
+    else:
+        # Float formatting dominates here and geocoded rows share few distinct places, so format each place once
+        codes, places = pd.factorize(longitudes[valid] + 1j * latitudes[valid])
+        text = np.char.add(np.char.add('SRID=4326;POINT(', places.real.astype(str)), ' ')
+        text = np.char.add(np.char.add(text, places.imag.astype(str)), ')')
+        geometry[valid] = text.astype(object)[codes]
+    return geometry
+
+def resolve_post_dates(post_dates, scrap_times):
+    # Vectorized calculate_post_date: days ago are parsed once per distinct string, dates for the whole column
+    codes, uniques = pd.factorize(pd.Series(post_dates.to_numpy(dtype=object), dtype=object))
+    text = pd.Series(uniques, dtype=object)
+
+    days = text.str.extract(r'(\d+)', expand=False).astype(float)
+    days = days.where(text.str.contains('day', regex=False).fillna(False))
+    days = days.mask(text.str.contains('30+', regex=False).fillna(False) & days.isna(), 30)
+    days = days.mask((text.str.contains('Just posted', regex=False) | text.str.contains('Today', regex=False))
+                     .fillna(False), 0)
+    # Missing post dates have code -1, which picks the trailing NaN
+    days = np.append(days.to_numpy(dtype=float), np.nan)[codes]
+
+    scrap_days = pd.to_datetime(scrap_times).dt.normalize()
+    resolved = scrap_days - pd.to_timedelta(days, unit='D')
+    return resolved.dt.date.where(resolved.notna(), None)
+
 def convert_to_annual(salary_str):
-    print(f"Processing salary string: {salary_str}")  # Debugging line
+    logger.debug("Processing salary string: %s", salary_str)  # Debugging line
 
     if pd.isna(salary_str):
         return np.nan  # Keep NaN values as they are
@@ -229,12 +509,52 @@ def convert_to_annual(salary_str):
     elif 'day' in salary_str:
         annual_salary = sum(numbers) / len(numbers) * 5 * 52
     else:
-        print("Salary period not recognized, returning NaN")  # Debugging line
+        logger.debug("Salary period not recognized, returning NaN")  # Debugging line
         return np.nan
     
-    print(f"Calculated annual salary: {annual_salary}")  # Debugging line
+    logger.debug("Calculated annual salary: %s", annual_salary)  # Debugging line
     return annual_salary
 
+# Checked in this order, as in convert_to_annual; hourly and daily pay assume 40 h / 5 days a week
+SALARY_PERIODS = ['year', 'month', 'hour', 'week', 'day']
+SALARY_FACTORS = [(1, 1), (12, 1), (40, 52), (52, 1), (5, 52)]
+
+def annualize_salaries(salaries):
+    # Vectorized convert_to_annual: same annual values, plus the range and period they came from.
+    # Salary strings repeat heavily, so the work is done once per distinct string and then broadcast.
+    codes, uniques = pd.factorize(pd.Series(salaries.to_numpy(dtype=object), dtype=object))
+    text = pd.Series(uniques, dtype=object)
+
+    # One column per number found in the string, in order of appearance
+    numbers = text.str.findall(r'[\d\,]+\.?\d*').explode()
+    numbers = pd.to_numeric(numbers.str.replace(',', '', regex=False), errors='coerce')
+    amounts = numbers.to_frame('amount').set_index(numbers.groupby(level=0).cumcount(), append=True)['amount']
+    amounts = amounts.unstack().reindex(text.index)
+
+    # Summed left to right like sum() so the mean is bit-for-bit the same as the row-wise version
+    total = pd.Series(0.0, index=text.index)
+    for column in amounts.columns:
+        total = total + amounts[column].fillna(0.0)
+    count = amounts.notna().sum(axis=1)
+    mean = (total / count.where(count > 0)).to_numpy(dtype=float)
+
+    matches = [text.str.contains(period, regex=False).fillna(False).to_numpy(dtype=bool) for period in SALARY_PERIODS]
+    first_factor = np.select(matches, [first for first, _ in SALARY_FACTORS], default=np.nan)
+    second_factor = np.select(matches, [second for _, second in SALARY_FACTORS], default=np.nan)
+    annual = mean * first_factor * second_factor
+    period = np.where(np.isnan(annual), None, np.select(matches, SALARY_PERIODS, default=None))
+
+    # Missing salaries have code -1, which picks the trailing empty slot
+    def broadcast(values, empty):
+        return np.append(values, np.array([empty], dtype=values.dtype))[codes]
+
+    return pd.DataFrame({
+        'salary': broadcast(annual, np.nan),
+        'salary_min': broadcast(amounts.min(axis=1).to_numpy(dtype=float) * first_factor * second_factor, np.nan),
+        'salary_max': broadcast(amounts.max(axis=1).to_numpy(dtype=float) * first_factor * second_factor, np.nan),
+        'salary_period': broadcast(period.astype(object), None),
+    }, index=salaries.index)
+
 
 # def scrape_job_description(browser, url):
 #     browser.get_browser()
@@ -255,42 +575,29 @@ def convert_to_annual(salary_str):
 #     return job_description
 
 
-def process_data(df, geocoder, browser):
-    
-    df_no_duplicate = df.drop_duplicates(subset=['job_jk']).copy()
-    df_no_duplicate.drop(columns=['job_keyword'], inplace=True)
-    print("DataFrame shape after dropping duplicates:", df_no_duplicate.shape)  # Debugging line for duplicates
-
-    df_no_duplicate['salary'].replace('Not available', np.nan, inplace=True)
-    df_no_duplicate['salary'] = np.ceil(df_no_duplicate['salary'].apply(convert_to_annual)).astype('Int64')
-    print("Sample data after salary conversion:\n", df_no_duplicate[['salary']].head())  # Debugging line for salary conversion
-
-#     # Geocoding
-#      # Geocoding
-#    # Assuming df_no_duplicate is your DataFrame and geocoder is an instance of the Geocoder class
-#     df_no_duplicate.loc[:, 'coords'] = df_no_duplicate['job_location'].apply(geocoder.geocode_location)
-#     print(df_no_duplicate.head(5))
-#     df_no_duplicate[['latitude', 'longitude']] = pd.DataFrame(df_no_duplicate['coords'].tolist(), index=df_no_duplicate.index)
-#     df_no_duplicate.drop(columns=['coords'], inplace=True)
-#     print(df_no_duplicate.head(5))
-#     # Concatenate latitude and longitude into a geometry column
-#     df_no_duplicate.loc[:, 'geom'] = df_no_duplicate.apply(lambda row: f"SRID=4326;POINT({row['longitude']} {row['latitude']})"
-#                                     if pd.notna(row['longitude']) and pd.notna(row['latitude'])
-#                                     else None, axis=1)
-#     df_no_duplicate.drop(columns=['latitude', 'longitude'], inplace=True)
-#     print(df_no_duplicate.head(5))
-#     # Swap columns
-#     df_no_duplicate.loc[:, 'job_location'] = df_no_duplicate['geom']
-#     df_no_duplicate.drop(columns=['geom'], inplace=True)
-#     print(df_no_duplicate.head(5))
+def process_data(df, geocoder, browser, geocode=False, geometry_format='ewkt'):
+    started = time.perf_counter()
+    # Rows without a job key are all distinct postings; only keyed rows can be duplicates of each other
+    has_key = df['job_jk'].notna()
+    df_no_duplicate = df[~has_key | ~df['job_jk'].duplicated()].copy()
+    df_no_duplicate.drop(columns=['job_keyword', 'job_keywords'], errors='ignore', inplace=True)
+    logger.debug("DataFrame shape after dropping duplicates: %s", df_no_duplicate.shape)  # Debugging line for duplicates
+
+    salaries = annualize_salaries(df_no_duplicate['salary'].replace('Not available', np.nan))
+    df_no_duplicate['salary'] = np.ceil(salaries['salary']).astype('Int64')
+    logger.debug("Sample data after salary conversion:\n%s", df_no_duplicate[['salary']].head())  # Debugging line for salary conversion
+
+    # Geocoding: replace the location text with a PostGIS point (one lookup per distinct place)
+    if geocode:
+        coords = geocoder.geocode_column(df_no_duplicate['job_location'])
+        df_no_duplicate['job_location'] = build_geometry(coords['latitude'], coords['longitude'], geometry_format)
+        logger.debug("%s", df_no_duplicate[['job_location']].head(5))
 
     # Convert 'scrap_time' to datetime
     df_no_duplicate.loc[:, 'scrap_time'] = pd.to_datetime(df_no_duplicate['scrap_time'])
 
-    # Apply the functions to the DataFrame
-    df_no_duplicate.loc[:, 'actual_post_date'] = df_no_duplicate.apply(calculate_post_date, axis=1)
-    df_no_duplicate.loc[:, 'post_date'] = df_no_duplicate['actual_post_date']
-    df_no_duplicate.drop(columns=['actual_post_date'], inplace=True)
+    # Turn the relative "N days ago" strings into dates
+    df_no_duplicate['post_date'] = resolve_post_dates(df_no_duplicate['post_date'], df_no_duplicate['scrap_time'])
 
     # Add empty 'location_keyword' column
     df_no_duplicate.loc[:, 'location_keyword'] = ''
@@ -309,7 +616,9 @@ def process_data(df, geocoder, browser):
     #print(df_no_duplicate.head(5))
     df_no_duplicate.drop(columns=['cleaned'],inplace=True)
  #   print(df_no_duplicate.head(5))
-    print(f"Number of rows after processing: {len(df_no_duplicate)}")  # Debugging line
+    logger.info(f"Number of rows after processing: {len(df_no_duplicate)}")  # Debugging line
+    PROCESS_SECONDS.observe(time.perf_counter() - started)
+    ROWS_TOTAL.inc(len(df_no_duplicate), stage='processed')
     return df_no_duplicate
 
 # def main():
@@ -339,37 +648,116 @@ def log_execution_time():
     with open("script_execution_log.txt", "a") as file:
         file.write(f"Script executed at {datetime.now()}\n")
 
+def clean_stream(db, geocoder, browser, table_name, chunk_size, process_options=None):
+    # Works through the whole backlog; each chunk is written and marked cleaned in one transaction
+    processed_rows = 0
+    for chunk in db.iter_uncleaned(table_name, chunk_size):
+        df_unique = process_data(chunk, geocoder, browser, **(process_options or {}))
+        db.commit_chunk(chunk, df_unique, 'processed_jobs')
+        processed_rows += len(df_unique)
+        logger.info(f"Chunk committed. Rows processed so far: {processed_rows}")  # Debugging line
+    if processed_rows == 0:
+        raise Exception("No data to be cleaned")
+    return processed_rows
+
+def clean_claims(worker_id, table_name, batch_size, process_options=None):
+    # One cleaner: claims, processes and commits batches in id order until nothing is left to claim
+    metrics.start_snapshots('cleaner')
+    db = DatabaseConnection()
+    geocoder = Geocoder(engine=db.engine)
+    processed_rows = 0
+    after_id = 0
+    while True:
+        with db.engine.begin() as conn:
+            chunk = db.claim_batch(conn, table_name, batch_size, after_id)
+            if not chunk.empty:
+                df_unique = process_data(chunk, geocoder, None, **(process_options or {}))
+                db.commit_chunk(chunk, df_unique, 'processed_jobs', conn=conn)
+        if chunk.empty:
+            if after_id == 0:
+                break
+            # Rows skipped while another cleaner held them may have been released; rescan from the start once
+            after_id = 0
+            continue
+        after_id = int(chunk['id'].max())
+        processed_rows += len(df_unique)
+        logger.info(f"Cleaner {worker_id} committed rows up to id {after_id}. Rows processed: {processed_rows}")
+    db.dispose()
+    metrics.write_snapshot()
+    flush_logging()
+    return processed_rows
+
+def clean_parallel(table_name, batch_size, workers, process_options=None):
+    if workers == 1:
+        return clean_claims(0, table_name, batch_size, process_options)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        counts = pool.map(clean_claims, range(workers), [table_name] * workers, [batch_size] * workers,
+                          [process_options] * workers)
+        return sum(counts)
+
 def main():
-    
     load_dotenv()
-    print("Environment variables loaded.")  # Debugging line
+    setup_logging()
+    logger.info("Environment variables loaded.")  # Debugging line
+    parser = argparse.ArgumentParser(description='Clean scraped job postings into processed_jobs.')
+    parser.add_argument('--row-limit', type=int, default=200, help='Rows cleaned by a single batch run')
+    parser.add_argument('--stream', action='store_true',
+                        help='Clean the whole backlog in chunks read through a server-side cursor')
+    parser.add_argument('--chunk-size', type=int, default=int(os.getenv('CLEANING_CHUNK_SIZE', 5000)),
+                        help='Rows per chunk in streaming and claim modes')
+    parser.add_argument('--claim', action='store_true',
+                        help='Claim batches with FOR UPDATE SKIP LOCKED so several cleaners can run at once')
+    parser.add_argument('--workers', type=int, default=int(os.getenv('CLEANING_WORKERS', 1)),
+                        help='Cleaner processes to run in claim mode')
+    parser.add_argument('--geocode', action='store_true',
+                        default=os.getenv('GEOCODE', '').lower() in ('1', 'true', 'yes'),
+                        help='Replace job locations with geocoded PostGIS points')
+    parser.add_argument('--geometry-format', choices=['ewkt', 'ewkb'], default=os.getenv('GEOMETRY_FORMAT', 'ewkt'),
+                        help='Encoding of geocoded points; ewkb hex is parsed natively by a PostGIS geometry column')
+    parser.add_argument('--metrics-port', type=int, default=int(os.getenv('METRICS_PORT', 0) or 0),
+                        help='Serve Prometheus metrics on this port while cleaning (0 disables)')
+    args = parser.parse_args()
+
+    metrics.start_snapshots('cleaning')
+    metrics.start_http_server(args.metrics_port)
+
     db = DatabaseConnection()
-    print("Database connection established.")  # Debugging line
-    geocoder = Geocoder()
-    print("Geocoder initialized.")  # Debugging line
+    logger.info("Database connection established.")  # Debugging line
+    geocoder = Geocoder(engine=db.engine)
+    logger.info("Geocoder initialized.")  # Debugging line
     browser = Browser()
-    print("Browser initialized.")  # Debugging line
+    logger.info("Browser initialized.")  # Debugging line
     telegram_notifier = TelebotNotifier()
-    print("Telegram notifier initialized.")  # Debugging line
+    logger.info("Telegram notifier initialized.")  # Debugging line
     table_name = os.getenv('DB_TABLE_NAME')
     
-    try:
-        df = db.fetch_data(table_name, row_limit=200)
-        print(f"Data fetched from table: {table_name}")  # Debugging line
-        df_unique = process_data(df, geocoder, browser)
-        print("Data processed.")  # Debugging line
+    process_options = {'geocode': args.geocode, 'geometry_format': args.geometry_format}
 
-        db.update_data(df)
-        print("Data updated.")  # Debugging line
-        db.append_data(df_unique, 'processed_jobs')
-        print("Data appended.")  # Debugging line
+    try:
+        db.create_indexes(table_name)
+        if args.claim:
+            processed_rows = clean_parallel(table_name, args.chunk_size, max(1, args.workers), process_options)
+            if processed_rows == 0:
+                raise Exception("No data to be cleaned")
+        elif args.stream:
+            processed_rows = clean_stream(db, geocoder, browser, table_name, args.chunk_size, process_options)
+        else:
+            df = db.fetch_data(table_name, row_limit=args.row_limit)
+            logger.info(f"Data fetched from table: {table_name}")  # Debugging line
+            df_unique = process_data(df, geocoder, browser, **process_options)
+            logger.info("Data processed.")  # Debugging line
+
+            db.commit_chunk(df, df_unique, 'processed_jobs')
+            logger.info("Data appended and source rows marked cleaned.")  # Debugging line
+            processed_rows = len(df_unique)
 
         db.dispose()
-        print("Database connection disposed.")  # Debugging line
-        telegram_notifier.send_notification(f"Cleaning completed. Number of rows processed: {len(df_unique)}")
-        print("Notification sent.")  # Debugging line
+        logger.info("Database connection disposed.")  # Debugging line
+        browser.close()
+        telegram_notifier.send_notification(f"Cleaning completed. Number of rows processed: {processed_rows}")
+        logger.info("Notification sent.")  # Debugging line
     except Exception as e:
-        print(f"Error: {e}")
+        logger.error(f"Error: {e}")
         telegram_notifier.send_notification(f"Cleaning failed. Error: {e}")
         
 if __name__ == "__main__":
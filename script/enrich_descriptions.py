@@ -0,0 +1,305 @@
+import argparse
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import psycopg2
+import requests
+from dotenv import load_dotenv
+from lxml import etree as et
+from psycopg2 import extras
+
+import metrics
+from job_scrapping import BrowserPool, HttpFetcher, RateLimiter, base_url, parse_page
+from logging_setup import setup_logging
+
+logger = logging.getLogger('enrich_descriptions')
+
+DESCRIPTION_FETCH_SECONDS = metrics.histogram('jobspy_description_fetch_seconds', 'Time to fetch one job detail page',
+                                              ['fetcher'])
+DESCRIPTIONS_TOTAL = metrics.counter('jobspy_descriptions_total', 'Job detail pages by outcome', ['result'])
+
+description_xpath = et.XPath('//div[@id="jobDescriptionText"]')
+
+def detail_url(job_jk):
+    # The canonical posting page; the links stored from search cards are tracking redirects to it
+    return f"{base_url}/viewjob?jk={job_jk}"
+
+def description_text(dom):
+    # Text of the description block with whitespace collapsed, or None when the page has none
+    blocks = description_xpath(dom) if dom is not None else []
+    if not blocks:
+        return None
+    return ' '.join(' '.join(blocks[0].itertext()).split()) or None
+
+class DescriptionStore:
+    # Enrichment progress per job key in <DB_TABLE_NAME>_descriptions: rows are claimed with a lease, so a run
+    # that crashes only delays its claimed keys until the lease runs out and another run picks them up
+    def __init__(self, lease_seconds=None, max_attempts=None, retry_seconds=None):
+        self.jobs_table = os.getenv('DB_TABLE_NAME')
+        self.table = f"{self.jobs_table}_descriptions"
+        self.lease_seconds = int(lease_seconds or os.getenv('ENRICH_LEASE_SECONDS', 600))
+        self.max_attempts = int(max_attempts or os.getenv('ENRICH_MAX_ATTEMPTS', 3))
+        self.retry_seconds = int(retry_seconds or os.getenv('ENRICH_RETRY_SECONDS', 3600))
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.processed_table = False
+        self.conn = psycopg2.connect(
+            dbname=os.getenv('DB_NAME'),
+            user=os.getenv('DB_USER'),
+            password=os.getenv('DB_PASSWORD'),
+            host=os.getenv('DB_HOST'),
+            port=os.getenv('DB_PORT')
+        )
+        logger.info("Database connection established.")
+        self.create_table()
+
+    def create_table(self):
+        with self.conn.cursor() as cur:
+            try:
+                cur.execute(f"CREATE TABLE IF NOT EXISTS {self.table} ("
+                            "job_jk TEXT PRIMARY KEY,"
+                            "status TEXT NOT NULL DEFAULT 'pending',"
+                            "attempts INTEGER NOT NULL DEFAULT 0,"
+                            "owner TEXT,"
+                            "lease_until TIMESTAMPTZ,"
+                            "description TEXT,"
+                            "error TEXT,"
+                            "fetched_at TIMESTAMPTZ,"
+                            "updated_at TIMESTAMPTZ NOT NULL DEFAULT now()"
+                            ")")
+                # Claims only ever look at unfinished keys, however many descriptions are stored
+                cur.execute(f"CREATE INDEX IF NOT EXISTS {self.table}_open_idx ON {self.table} (updated_at) "
+                            "WHERE status IN ('pending', 'running', 'failed')")
+                # Postings cleaned before their description arrived are updated in place, by job key
+                cur.execute("SELECT to_regclass('processed_jobs')")
+                self.processed_table = cur.fetchone()[0] is not None
+                if self.processed_table:
+                    cur.execute("CREATE INDEX IF NOT EXISTS processed_jobs_job_jk_idx ON processed_jobs (job_jk)")
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                logger.error(f"Error creating/checking descriptions table: {e}")
+
+    def enqueue(self, since_days=None):
+        # New job keys become pending; keys already enriched, failed or in flight are left as they are
+        window = "AND scrap_time >= now() - %s * INTERVAL '1 day'" if since_days else ''
+        with self.conn.cursor() as cur:
+            try:
+                cur.execute(f"INSERT INTO {self.table} (job_jk) "
+                            f"SELECT DISTINCT job_jk FROM {self.jobs_table} WHERE job_jk IS NOT NULL {window} "
+                            "ON CONFLICT (job_jk) DO NOTHING",
+                            (since_days,) if since_days else None)
+                added = cur.rowcount
+                self.conn.commit()
+                logger.info(f"Queued {added} new job keys for description enrichment.")
+                return added
+            except Exception as e:
+                self.conn.rollback()
+                logger.error(f"Error queueing job keys: {e}")
+                return 0
+
+    def claim(self, limit):
+        # Pending keys, keys whose claim expired with a crashed run, and failed keys due for another try
+        with self.conn.cursor() as cur:
+            try:
+                cur.execute(f"UPDATE {self.table} SET status = 'running', attempts = attempts + 1, owner = %s, "
+                            "lease_until = now() + %s * INTERVAL '1 second', updated_at = now() "
+                            f"WHERE job_jk IN (SELECT job_jk FROM {self.table} "
+                            "WHERE status IN ('pending', 'running', 'failed') AND attempts < %s "
+                            "AND (status = 'pending' OR (status = 'running' AND lease_until < now()) "
+                            "OR (status = 'failed' AND updated_at < now() - %s * INTERVAL '1 second')) "
+                            "ORDER BY updated_at LIMIT %s FOR UPDATE SKIP LOCKED) "
+                            "RETURNING job_jk",
+                            (self.owner, self.lease_seconds, self.max_attempts, self.retry_seconds, limit))
+                keys = [row[0] for row in cur.fetchall()]
+                self.conn.commit()
+                return keys
+            except Exception as e:
+                self.conn.rollback()
+                logger.error(f"Error claiming job keys: {e}")
+                return []
+
+    def complete(self, results):
+        # Checkpoint: results of one batch in one transaction; keys another run has since taken over are skipped
+        if not results:
+            return
+        with self.conn.cursor() as cur:
+            try:
+                extras.execute_batch(
+                    cur,
+                    f"UPDATE {self.table} SET status = %s, description = %s, error = %s, owner = NULL, "
+                    "lease_until = NULL, fetched_at = now(), updated_at = now() "
+                    "WHERE job_jk = %s AND owner = %s",
+                    [(status, description, error, job_jk, self.owner) for job_jk, status, description, error in results]
+                )
+                # Later cleaning runs pick the text up from this table; rows already cleaned get it here
+                if self.processed_table:
+                    extras.execute_batch(
+                        cur,
+                        "UPDATE processed_jobs SET job_description = %s WHERE job_jk = %s",
+                        [(description, job_jk) for job_jk, status, description, _ in results if status == 'done']
+                    )
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                logger.error(f"Error saving {len(results)} descriptions: {e}")
+
+    def release(self):
+        # Keys claimed but not fetched when the run stops go straight back to pending without using up an attempt
+        with self.conn.cursor() as cur:
+            try:
+                cur.execute(f"UPDATE {self.table} SET status = 'pending', attempts = attempts - 1, owner = NULL, "
+                            "lease_until = NULL WHERE owner = %s AND status = 'running'", (self.owner,))
+                if cur.rowcount:
+                    logger.info(f"Released {cur.rowcount} unfinished job keys.")
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                logger.error(f"Error releasing job keys: {e}")
+
+    def close(self):
+        self.conn.close()
+
+class DescriptionFetcher:
+    # Consecutive detail pages plain HTTP could not read after which the rest of the run goes straight to Chrome
+    MAX_HTTP_FALLBACKS = 5
+
+    def __init__(self, concurrency=4, rate=None, fetcher=None, browsers=None):
+        fetcher = fetcher or os.getenv('ENRICH_FETCHER', 'http')
+        self.http = HttpFetcher(pool_size=concurrency) if fetcher == 'http' else None
+        # Chrome is only started for pages that need it, and never more sessions than this at once
+        self.selenium = BrowserPool(size=browsers or int(os.getenv('ENRICH_BROWSERS', 1)), headless=True,
+                                    warmup=False)
+        # Shared by every fetch thread: the total page rate against Indeed, not a per-thread one
+        self.rate_limiter = RateLimiter(rate if rate is not None else float(os.getenv('ENRICH_RATE', 1)),
+                                        burst=concurrency)
+        self.http_fallbacks = 0
+        self.lock = threading.Lock()
+
+    def fetch_description(self, job_jk):
+        # Returns ('done', text), or ('gone', None) for a posting that has been taken down
+        url = detail_url(job_jk)
+        self.rate_limiter.acquire()
+        if self.http is not None and self.http_fallbacks < self.MAX_HTTP_FALLBACKS:
+            try:
+                with DESCRIPTION_FETCH_SECONDS.time(fetcher='http'):
+                    page_content = self.http.fetch(url)
+                description = description_text(parse_page(page_content, sanitize=True))
+                if description is not None:
+                    self.http_fallbacks = 0
+                    return 'done', description
+                logger.debug("No description over HTTP, falling back to Selenium: %s", url)
+            except requests.HTTPError as e:
+                if e.response is not None and e.response.status_code in (404, 410):
+                    return 'gone', None
+                logger.debug("HTTP fetch failed, falling back to Selenium: %s", e)
+            except requests.RequestException as e:
+                logger.debug("HTTP fetch failed, falling back to Selenium: %s", e)
+            with self.lock:
+                self.http_fallbacks += 1
+                if self.http_fallbacks == self.MAX_HTTP_FALLBACKS:
+                    logger.warning("Detail pages keep failing over HTTP, using Selenium for the rest of the run.")
+        with DESCRIPTION_FETCH_SECONDS.time(fetcher='selenium'):
+            page_content = self.selenium.fetch(url)
+        description = description_text(parse_page(page_content, sanitize=True))
+        if description is None:
+            raise ValueError("page has no job description")
+        return 'done', description
+
+    def fetch(self, job_jk):
+        try:
+            status, description = self.fetch_description(job_jk)
+            DESCRIPTIONS_TOTAL.inc(result=status)
+            return job_jk, status, description, None
+        except Exception as e:
+            DESCRIPTIONS_TOTAL.inc(result='failed')
+            logger.warning(f"Could not fetch description for {job_jk}: {e}")
+            return job_jk, 'failed', None, str(e)[:500]
+
+    def close(self):
+        if self.http is not None:
+            self.http.close()
+        self.selenium.close()
+
+def enrich(store, fetcher, concurrency=4, batch_size=50, limit=None):
+    # Keeps every fetch thread busy: more keys are claimed whenever fewer than `concurrency` are in flight,
+    # and finished results are checkpointed every batch_size keys
+    summary = {'claimed': 0, 'done': 0, 'gone': 0, 'failed': 0}
+    started = time.monotonic()
+    executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='enrich')
+    in_flight = set()
+    results = []
+    exhausted = False
+    try:
+        while True:
+            if not exhausted and len(in_flight) < concurrency:
+                wanted = batch_size if limit is None else min(batch_size, limit - summary['claimed'])
+                keys = store.claim(wanted) if wanted > 0 else []
+                exhausted = len(keys) < wanted or wanted <= 0
+                summary['claimed'] += len(keys)
+                in_flight.update(executor.submit(fetcher.fetch, job_jk) for job_jk in keys)
+            if not in_flight:
+                break
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                result = future.result()
+                summary[result[1]] += 1
+                results.append(result)
+            if len(results) >= batch_size:
+                store.complete(results)
+                results = []
+                logger.info(f"Descriptions so far: {summary['done']} fetched, {summary['gone']} gone, "
+                            f"{summary['failed']} failed.")
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+        store.complete(results)
+        store.release()
+    summary['elapsed'] = time.monotonic() - started
+    return summary
+
+def main():
+    load_dotenv()
+    setup_logging()
+    parser = argparse.ArgumentParser(description='Fetch full job descriptions for scraped postings.')
+    parser.add_argument('--since-days', type=int, default=int(os.getenv('ENRICH_SINCE_DAYS', 7)),
+                        help='Queue job keys scraped in the last N days (0 queues every stored job)')
+    parser.add_argument('--concurrency', type=int, default=int(os.getenv('ENRICH_CONCURRENCY', 4)),
+                        help='Detail pages fetched at once')
+    parser.add_argument('--rate', type=float, default=float(os.getenv('ENRICH_RATE', 1)),
+                        help='Detail pages per second across all fetches (0 disables the limit)')
+    parser.add_argument('--browsers', type=int, default=int(os.getenv('ENRICH_BROWSERS', 1)),
+                        help='Chrome sessions for pages plain HTTP cannot read')
+    parser.add_argument('--fetcher', choices=['http', 'selenium'], default=os.getenv('ENRICH_FETCHER', 'http'),
+                        help='Page fetcher; http falls back to Selenium for pages without a readable description')
+    parser.add_argument('--batch-size', type=int, default=int(os.getenv('ENRICH_BATCH_SIZE', 50)),
+                        help='Job keys claimed at a time and results saved per checkpoint')
+    parser.add_argument('--limit', type=int, help='Stop after this many job keys')
+    parser.add_argument('--metrics-port', type=int, default=int(os.getenv('METRICS_PORT', 0) or 0),
+                        help='Serve Prometheus metrics on this port while the run is going (0 disables)')
+    args = parser.parse_args()
+
+    metrics.start_snapshots('enrich')
+    metrics.start_http_server(args.metrics_port)
+    concurrency = max(1, args.concurrency)
+    store = DescriptionStore()
+    fetcher = DescriptionFetcher(concurrency=concurrency, rate=args.rate, fetcher=args.fetcher,
+                                 browsers=max(1, args.browsers))
+    try:
+        store.enqueue(args.since_days)
+        summary = enrich(store, fetcher, concurrency=concurrency, batch_size=max(1, args.batch_size),
+                         limit=args.limit)
+        logger.info(f"Enrichment summary: {summary['done']} descriptions fetched, {summary['gone']} postings gone, "
+                    f"{summary['failed']} failed, out of {summary['claimed']} claimed in "
+                    f"{summary['elapsed'] / 60:.1f} min.")
+    except Exception as e:
+        logger.error(f"An error occurred: {e}")
+    finally:
+        fetcher.close()
+        store.close()
+
+if __name__ == '__main__':
+    main()
@@ -1,22 +1,60 @@
+from collections import Counter, namedtuple
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
+from functools import lru_cache
+import itertools
+import json
+import logging
+import multiprocessing
 import os
+import queue
 import re
+import socket
+import threading
 import time
+import uuid
+from urllib.parse import parse_qs, urlparse
 import telebot
+import psutil
 import psycopg2
-from bs4 import BeautifulSoup
+import requests
 from dotenv import load_dotenv
 from lxml import etree as et
 from psycopg2 import extras
+from requests.adapters import HTTPAdapter
 from selenium import webdriver
+from selenium.common.exceptions import SessionNotCreatedException, TimeoutException, WebDriverException
 from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.support.ui import WebDriverWait
 from webdriver_manager.chrome import ChromeDriverManager
 import argparse
 from selenium.webdriver.chrome.service import Service
 
+import metrics
+from archive import PageArchive
+from logging_setup import flush_logging, setup_logging
+
 load_dotenv()
+setup_logging()
+logger = logging.getLogger('job_scrapping')
+
+logger.info("Loaded environment variables.")
 
-print("Loaded environment variables.")
+SEARCH_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600, float('inf'))
+PAGE_FETCH_SECONDS = metrics.histogram('jobspy_page_fetch_seconds', 'Time to fetch one search result page',
+                                       ['fetcher'])
+PAGE_PARSE_SECONDS = metrics.histogram('jobspy_page_parse_seconds', 'Time to parse a fetched page into a DOM')
+PAGES_TOTAL = metrics.counter('jobspy_pages_total', 'Search result pages requested', ['result'])
+EXTRACT_SECONDS = metrics.histogram('jobspy_extract_seconds', 'Time to extract every job card on a page')
+CARDS_TOTAL = metrics.counter('jobspy_cards_total', 'Job cards extracted from result pages')
+JOBS_TOTAL = metrics.counter('jobspy_jobs_total', 'Job cards by whether they were stored or skipped', ['result'])
+UNITS_TOTAL = metrics.counter('jobspy_scrape_units_total', 'Result pages fetched here or shared by another run',
+                              ['source'])
+SEARCH_SECONDS = metrics.histogram('jobspy_search_seconds', 'Time to scrape one keyword and location',
+                                   buckets=SEARCH_BUCKETS)
+DB_ROWS_TOTAL = metrics.counter('jobspy_db_rows_total', 'Job rows by write stage', ['stage'])
+DB_FLUSH_SECONDS = metrics.histogram('jobspy_db_flush_seconds', 'Time to upsert one batch of job rows')
+ERRORS_TOTAL = metrics.counter('jobspy_errors_total', 'Errors by pipeline stage', ['stage'])
 
 class TelebotNotifier:
     def __init__(self):
@@ -27,12 +65,35 @@ class TelebotNotifier:
     def send_notification(self, message):
         try:
             self.bot.send_message(self.chat_id, message)
-            print(f"Notification sent: {message}")
+            logger.info(f"Notification sent: {message}")
         except Exception as e:
-            print(f"Failed to send notification. Error: {e}")
+            logger.error(f"Failed to send notification. Error: {e}")
 
 class JobDatabase:
-    def __init__(self):
+    COLUMNS = ('post_date', 'job_link', 'job_title', 'job_location', 'company_name', 'salary',
+               'job_description', 'job_type', 'job_keyword', 'scrap_time', 'job_jk', 'job_keywords')
+    # Columns read off the search card, refreshed in overwrite mode
+    CARD_COLUMNS = ('post_date', 'job_link', 'job_title', 'job_location', 'company_name', 'salary',
+                    'job_description', 'job_type')
+
+    def __init__(self, batch_size=None, flush_interval=None, overwrite=False):
+        # Records are buffered and written in batches; flush when either threshold is hit
+        self.batch_size = int(batch_size or os.getenv('DB_BATCH_SIZE', 500))
+        self.flush_interval = float(flush_interval or os.getenv('DB_FLUSH_INTERVAL', 30))
+        self.buffer = []
+        self.last_flush = time.monotonic()
+        # Replace the card columns of postings that are already stored instead of only merging keywords
+        self.overwrite = overwrite
+        # Set once the table is known to have the cleaning stage's flag
+        self.reset_cleaned = False
+        # How far back before the last run's high-water mark seen job keys are loaded
+        self.seen_window_days = int(os.getenv('SCRAPE_SEEN_WINDOW_DAYS', 45))
+        # Result pages shared between concurrent runs: how long a claimed page may stay in flight,
+        # and how long a finished page is reused instead of fetched again
+        self.coalesce = os.getenv('SCRAPE_COALESCE', 'true').lower() in ('1', 'true', 'yes')
+        self.unit_lease_seconds = int(os.getenv('SCRAPE_UNIT_LEASE_SECONDS', 300))
+        self.unit_ttl_seconds = int(os.getenv('SCRAPE_UNIT_TTL_SECONDS', 900))
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
         try:
             self.conn = psycopg2.connect(
                 dbname=os.getenv('DB_NAME'),
@@ -41,15 +102,28 @@ class JobDatabase:
                 host=os.getenv('DB_HOST'),
                 port=os.getenv('DB_PORT')
             )
-            print("Database connection established.")
+            logger.info("Database connection established.")
             self.create_table()
-            print("Database table checked/created.")
+            logger.debug("Database table checked/created.")
+            # A posting whose card changes is handed back to cleaning.py, which replaces its processed row
+            self.reset_cleaned = self.overwrite and self.has_column('cleaned')
         except Exception as e:
-            print(f"Error connecting to the database: {e}")
+            logger.error(f"Error connecting to the database: {e}")
+
+    def has_column(self, column):
+        with self.conn.cursor() as cur:
+            cur.execute("SELECT 1 FROM pg_attribute WHERE attrelid = to_regclass(%s) AND attname = %s "
+                        "AND NOT attisdropped", (os.getenv('DB_TABLE_NAME'), column))
+            found = cur.fetchone() is not None
+        self.conn.commit()
+        return found
 
     def create_table(self):
         with self.conn.cursor() as cur:
             try:
+                # Every scrape worker and pipeline stage builds a JobDatabase at startup; the schema checks and the
+                # job key migration run one process at a time, and the lock is released when this transaction ends
+                cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (f"{os.getenv('DB_TABLE_NAME')}_schema",))
                 cur.execute(f"CREATE TABLE IF NOT EXISTS {os.getenv('DB_TABLE_NAME')} ("
                             "id SERIAL PRIMARY KEY,"
                             "post_date TEXT,"
@@ -61,178 +135,920 @@ class JobDatabase:
                             "job_description TEXT,"
                             "job_type TEXT,"
                             "job_keyword TEXT,"
-                            "scrap_time TIMESTAMPTZ"
+                            "scrap_time TIMESTAMPTZ,"
+                            "job_jk TEXT,"
+                            "job_keywords TEXT[]"
+                            ")")
+                self.create_job_key_index(cur)
+                # Incremental scraping state: last completed run and job keys seen per search
+                cur.execute(f"CREATE TABLE IF NOT EXISTS {os.getenv('DB_TABLE_NAME')}_scrape_state ("
+                            "job_keyword TEXT,"
+                            "location_keyword TEXT,"
+                            "high_water_mark TIMESTAMPTZ,"
+                            "PRIMARY KEY (job_keyword, location_keyword)"
+                            ")")
+                cur.execute(f"CREATE TABLE IF NOT EXISTS {os.getenv('DB_TABLE_NAME')}_seen_jobs ("
+                            "job_keyword TEXT,"
+                            "location_keyword TEXT,"
+                            "job_jk TEXT,"
+                            "seen_at TIMESTAMPTZ,"
+                            "PRIMARY KEY (job_keyword, location_keyword, job_jk)"
+                            ")")
+                # One row per (keyword, location, radius, page) fetched by any run, for single-flight coalescing
+                cur.execute(f"CREATE TABLE IF NOT EXISTS {os.getenv('DB_TABLE_NAME')}_scrape_units ("
+                            "job_keyword TEXT,"
+                            "location_keyword TEXT,"
+                            "search_radius INTEGER,"
+                            "page_no INTEGER,"
+                            "status TEXT,"
+                            "owner TEXT,"
+                            "lease_until TIMESTAMPTZ,"
+                            "finished_at TIMESTAMPTZ,"
+                            "card_count INTEGER,"
+                            "PRIMARY KEY (job_keyword, location_keyword, search_radius, page_no)"
                             ")")
                 self.conn.commit()
-                print("Database table created/exists.")
+                logger.debug("Database table created/exists.")
             except Exception as e:
-                print(f"Error creating/checking table: {e}")
+                self.conn.rollback()
+                logger.error(f"Error creating/checking table: {e}")
+
+    def create_job_key_index(self, cur):
+        # One row per posting: the job key is unique and repeat sightings are merged on insert
+        table = os.getenv('DB_TABLE_NAME')
+        cur.execute("SELECT to_regclass(%s)", (f"{table}_job_jk_key",))
+        if cur.fetchone()[0] is not None:
+            return
+        # Tables created before the job key existed need the columns, a backfill and their duplicates merged
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS job_jk TEXT")
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS job_keywords TEXT[]")
+        cur.execute(f"UPDATE {table} SET job_jk = substring(job_link from '[?&]jk=([^&]+)') WHERE job_jk IS NULL")
+        cur.execute(f"UPDATE {table} SET job_keywords = ARRAY[job_keyword] WHERE job_keywords IS NULL")
+        cur.execute(f"""
+            UPDATE {table} SET job_keywords = merged.keywords
+            FROM (
+                SELECT job_jk, min(id) AS keep_id, array_agg(DISTINCT keyword) AS keywords
+                FROM {table}, unnest(job_keywords) AS keyword
+                WHERE job_jk IS NOT NULL
+                GROUP BY job_jk
+                HAVING count(DISTINCT id) > 1
+            ) AS merged
+            WHERE {table}.id = merged.keep_id
+        """)
+        cur.execute(f"DELETE FROM {table} AS duplicate USING {table} AS kept "
+                    "WHERE duplicate.job_jk = kept.job_jk AND duplicate.id > kept.id")
+        logger.info(f"Merged {cur.rowcount} duplicate job rows before adding the job key index.")
+        cur.execute(f"CREATE UNIQUE INDEX {table}_job_jk_key ON {table} (job_jk)")
+
+    def merge_duplicates(self, records):
+        # A single INSERT ... ON CONFLICT cannot touch the same row twice, so fold repeats within the batch
+        key_index = self.COLUMNS.index('job_jk')
+        keywords_index = self.COLUMNS.index('job_keywords')
+        merged = {}
+        unique_records = []
+        for record in records:
+            key = record[key_index]
+            if key is None:
+                unique_records.append(record)
+            elif key in merged:
+                keywords = merged[key][keywords_index]
+                keywords.extend(keyword for keyword in record[keywords_index] if keyword not in keywords)
+            else:
+                record = list(record)
+                record[keywords_index] = list(record[keywords_index])
+                merged[key] = record
+                unique_records.append(record)
+        return unique_records
 
     def insert_record(self, record):
+        self.buffer.append(record)
+        DB_ROWS_TOTAL.inc(stage='buffered')
+        if len(self.buffer) >= self.batch_size or time.monotonic() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def insert_records(self, records):
+        for record in records:
+            self.insert_record(record)
+
+    def flush(self):
+        self.last_flush = time.monotonic()
+        if not self.buffer:
+            return
+        records, self.buffer = self.merge_duplicates(self.buffer), []
+        with self.conn.cursor() as cur, DB_FLUSH_SECONDS.time():
+            try:
+                self.upsert(cur, records)
+                self.conn.commit()
+                DB_ROWS_TOTAL.inc(len(records), stage='written')
+                logger.debug("%d records upserted into database.", len(records))
+                return
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                # The connection is at fault, not the rows; keep them for the next flush
+                try:
+                    self.conn.rollback()
+                except psycopg2.Error:
+                    pass
+                self.buffer = records + self.buffer
+                ERRORS_TOTAL.inc(stage='db_flush')
+                logger.error(f"Error inserting {len(records)} records into database, keeping them buffered: {e}")
+                return
+            except Exception as e:
+                self.conn.rollback()
+                ERRORS_TOTAL.inc(stage='db_flush')
+                logger.error(f"Error inserting {len(records)} records into database, retrying them one by one: {e}")
+        # One bad row must not cost the rest of the batch
+        written = 0
+        for record in records:
+            with self.conn.cursor() as cur:
+                try:
+                    self.upsert(cur, [record])
+                    self.conn.commit()
+                    written += 1
+                except Exception as e:
+                    self.conn.rollback()
+                    logger.error(f"Error inserting record {record[1]} into database: {e}")
+        DB_ROWS_TOTAL.inc(written, stage='written')
+        DB_ROWS_TOTAL.inc(len(records) - written, stage='failed')
+
+    def upsert(self, cur, records):
+        # Postings already stored under another keyword or location only gain the new keyword,
+        # and in overwrite mode also take the card columns of the new record
+        refresh = ''.join(f"{column} = EXCLUDED.{column}, " for column in self.CARD_COLUMNS if self.overwrite)
+        if self.reset_cleaned:
+            # SET expressions see the stored row, so this compares the old card with the new one
+            stored = ', '.join(f"jobs.{column}" for column in self.CARD_COLUMNS)
+            incoming = ', '.join(f"EXCLUDED.{column}" for column in self.CARD_COLUMNS)
+            refresh += f"cleaned = jobs.cleaned AND ({stored}) IS NOT DISTINCT FROM ({incoming}), "
+        extras.execute_values(
+            cur,
+            f"INSERT INTO {os.getenv('DB_TABLE_NAME')} AS jobs ({', '.join(self.COLUMNS)}) VALUES %s "
+            f"ON CONFLICT (job_jk) DO UPDATE SET {refresh}job_keywords = ARRAY("
+            "SELECT DISTINCT unnest(jobs.job_keywords || EXCLUDED.job_keywords))",
+            records,
+            page_size=self.batch_size
+        )
+
+    def load_seen_keys(self, job_keyword, location_keyword):
+        # Results are sorted by date, so only keys seen shortly before the last run can show up again
+        table = os.getenv('DB_TABLE_NAME')
+        with self.conn.cursor() as cur:
+            cur.execute(f"SELECT high_water_mark FROM {table}_scrape_state "
+                        "WHERE job_keyword = %s AND location_keyword = %s", (job_keyword, location_keyword))
+            row = cur.fetchone()
+            if row is None:
+                self.conn.commit()
+                return None, set()
+            high_water_mark = row[0]
+            cur.execute(f"SELECT job_jk FROM {table}_seen_jobs "
+                        "WHERE job_keyword = %s AND location_keyword = %s AND seen_at >= %s - %s * INTERVAL '1 day'",
+                        (job_keyword, location_keyword, high_water_mark, self.seen_window_days))
+            seen_keys = {key for key, in cur.fetchall()}
+        self.conn.commit()
+        return high_water_mark, seen_keys
+
+    def mark_seen(self, job_keyword, location_keyword, job_keys, started_at):
+        # Records go out first so a key is never marked seen before its row is stored
+        self.flush()
+        table = os.getenv('DB_TABLE_NAME')
+        with self.conn.cursor() as cur:
+            try:
+                extras.execute_values(
+                    cur,
+                    f"INSERT INTO {table}_seen_jobs (job_keyword, location_keyword, job_jk, seen_at) VALUES %s "
+                    "ON CONFLICT DO NOTHING",
+                    [(job_keyword, location_keyword, key, started_at) for key in job_keys],
+                    page_size=self.batch_size
+                )
+                cur.execute(f"INSERT INTO {table}_scrape_state (job_keyword, location_keyword, high_water_mark) "
+                            "VALUES (%s, %s, %s) ON CONFLICT (job_keyword, location_keyword) "
+                            "DO UPDATE SET high_water_mark = EXCLUDED.high_water_mark",
+                            (job_keyword, location_keyword, started_at))
+                self.conn.commit()
+                logger.info(f"Marked {len(job_keys)} new job keys as seen for {job_keyword} in {location_keyword}.")
+            except Exception as e:
+                self.conn.rollback()
+                logger.error(f"Error updating scrape state: {e}")
+
+    def claim_unit(self, job_keyword, location_keyword, search_radius, page_no):
+        # Returns ('claimed', None) when this run should fetch the page, ('running', None) while another run
+        # holds it, or ('done', card_count) when another run stored it within the TTL
+        if not self.coalesce:
+            return 'claimed', None
+        table = os.getenv('DB_TABLE_NAME')
+        unit = (job_keyword, location_keyword, search_radius, page_no)
+        with self.conn.cursor() as cur:
+            try:
+                # Insert a fresh claim, or take over one whose lease ran out or whose result has gone stale
+                cur.execute(f"INSERT INTO {table}_scrape_units AS units "
+                            "(job_keyword, location_keyword, search_radius, page_no, status, owner, lease_until) "
+                            "VALUES (%s, %s, %s, %s, 'running', %s, now() + %s * INTERVAL '1 second') "
+                            "ON CONFLICT (job_keyword, location_keyword, search_radius, page_no) DO UPDATE "
+                            "SET status = 'running', owner = EXCLUDED.owner, lease_until = EXCLUDED.lease_until, "
+                            "finished_at = NULL, card_count = NULL "
+                            "WHERE (units.status = 'running' AND units.lease_until < now()) "
+                            "OR (units.status = 'done' AND units.finished_at < now() - %s * INTERVAL '1 second') "
+                            "RETURNING owner",
+                            unit + (self.owner, self.unit_lease_seconds, self.unit_ttl_seconds))
+                if cur.fetchone() is not None:
+                    self.conn.commit()
+                    return 'claimed', None
+                cur.execute(f"SELECT status, card_count FROM {table}_scrape_units "
+                            "WHERE job_keyword = %s AND location_keyword = %s AND search_radius = %s AND page_no = %s",
+                            unit)
+                row = cur.fetchone()
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                logger.warning(f"Error claiming scrape unit, fetching the page anyway: {e}")
+                return 'claimed', None
+        # The row can disappear between the two statements when its owner gives it up; just try again
+        return row if row is not None else ('running', None)
+
+    def complete_unit(self, job_keyword, location_keyword, search_radius, page_no, card_count):
+        # Records go out first so a page is never shared before its jobs are stored
+        if not self.coalesce:
+            return
+        self.flush()
+        table = os.getenv('DB_TABLE_NAME')
+        with self.conn.cursor() as cur:
+            try:
+                cur.execute(f"UPDATE {table}_scrape_units SET status = 'done', finished_at = now(), card_count = %s "
+                            "WHERE job_keyword = %s AND location_keyword = %s AND search_radius = %s AND page_no = %s "
+                            "AND owner = %s",
+                            (card_count, job_keyword, location_keyword, search_radius, page_no, self.owner))
+                self.conn.commit()
+            except Exception as e:
+                self.conn.rollback()
+                logger.error(f"Error completing scrape unit: {e}")
+
+    def release_unit(self, job_keyword, location_keyword, search_radius, page_no):
+        # A page that failed is handed back so a waiting run can fetch it itself
+        if not self.coalesce:
+            return
+        table = os.getenv('DB_TABLE_NAME')
         with self.conn.cursor() as cur:
             try:
-                cur.execute(f'''
-                INSERT INTO {os.getenv('DB_TABLE_NAME')} (post_date, job_link, job_title, job_location, company_name, salary, job_description, job_type, job_keyword, scrap_time)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ''', record)
+                cur.execute(f"DELETE FROM {table}_scrape_units "
+                            "WHERE job_keyword = %s AND location_keyword = %s AND search_radius = %s AND page_no = %s "
+                            "AND owner = %s AND status = 'running'",
+                            (job_keyword, location_keyword, search_radius, page_no, self.owner))
                 self.conn.commit()
-                print("Record inserted into database.")
             except Exception as e:
-                print(f"Error inserting record into database: {e}")
+                self.conn.rollback()
+                logger.error(f"Error releasing scrape unit: {e}")
 
     def close(self):
         try:
+            self.flush()
             self.conn.close()
-            print("Database connection closed.")
+            logger.info("Database connection closed.")
         except Exception as e:
-            print(f"Error closing database connection: {e}")
+            logger.error(f"Error closing database connection: {e}")
 
-class Browser:
-    def __init__(self):
-        self.browser = self.get_browser()
+@lru_cache(maxsize=None)
+def get_html_parser(sanitize=False):
+    if sanitize:
+        return et.HTMLParser(encoding='utf-8', remove_comments=True, remove_pis=True, no_network=True)
+    return et.HTMLParser(encoding='utf-8', no_network=True)
+
+def parse_page(page_content, sanitize=False):
+    # Build the lxml tree straight from the fetched page; bytes are expected to be UTF-8
+    dom = et.HTML(page_content, get_html_parser(sanitize))
+    if sanitize and dom is not None:
+        et.strip_elements(dom, 'script', 'style', 'noscript', with_tail=False)
+    return dom
+
+class RateLimiter:
+    # Token bucket: allows `rate` acquisitions per second on average with bursts of up to `burst`
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.capacity = max(1, burst)
+        # [tokens, last refill time]
+        self.state = [self.capacity, time.monotonic()]
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if not self.rate or self.rate <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            tokens = min(self.capacity, self.state[0] + (now - self.state[1]) * self.rate)
+            # Reserve a token now and sleep outside the lock until it has been earned
+            tokens -= 1
+            self.state[0], self.state[1] = tokens, now
+            wait = -tokens / self.rate if tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+class SharedRateLimiter(RateLimiter):
+    # The same bucket kept in shared memory, so every scrape worker process draws from one per-run budget
+    def __init__(self, rate, burst=1):
+        super().__init__(rate, burst)
+        self.state = multiprocessing.Array('d', self.state)
+        self.lock = self.state.get_lock()
+
+USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+# Markers of a bot challenge or client-side rendered shell that plain HTTP cannot get past
+JS_REQUIRED_MARKERS = ('challenge-platform', 'cf-chl-', 'Enable JavaScript and cookies to continue')
+# Present on every server-rendered search page: the result list container, a job card, or the no-results notice
+RENDERED_MARKERS = ('mosaic-provider-jobcards', 'job_seen_beacon', 'jobsearch-NoResult')
 
-    def get_browser(self):
+def needs_javascript(page_content):
+    encode = (lambda marker: marker.encode()) if isinstance(page_content, bytes) else (lambda marker: marker)
+    if any(encode(marker) in page_content for marker in JS_REQUIRED_MARKERS):
+        return True
+    # Search pages are server-rendered; an empty result list past the last page is still a valid page,
+    # only a page without the result list shell did not render for us
+    return not any(encode(marker) in page_content for marker in RENDERED_MARKERS)
+
+class HttpFetcher:
+    # Plain HTTP with a pooled keep-alive session; no browser process is started
+    def __init__(self, pool_size=10, timeout=30):
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'User-Agent': USER_AGENT,
+            'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
+            'Accept-Encoding': 'gzip, deflate',
+            'Accept-Language': 'en-US,en;q=0.9',
+            'Connection': 'keep-alive',
+        })
+
+    def fetch(self, url):
+        response = self.session.get(url, timeout=self.timeout)
+        response.raise_for_status()
+        # Hand the raw bytes to lxml when they are UTF-8 so the page is decoded only once
+        if (response.encoding or '').lower().replace('-', '') == 'utf8':
+            return response.content
+        return response.text
+
+    def close(self):
+        self.session.close()
+
+# Where the resolved chromedriver path is remembered between runs
+CHROMEDRIVER_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'job-spy', 'chromedriver_path')
+
+@lru_cache(maxsize=None)
+def chromedriver_path():
+    # ChromeDriverManager().install() checks for driver updates on every call; resolve the binary once
+    path = os.getenv('CHROMEDRIVER_PATH')
+    if path:
+        return path
+    try:
+        with open(CHROMEDRIVER_CACHE_FILE) as file:
+            path = file.read().strip()
+        if os.path.isfile(path):
+            return path
+    except OSError:
+        pass
+    path = ChromeDriverManager().install()
+    try:
+        os.makedirs(os.path.dirname(CHROMEDRIVER_CACHE_FILE), exist_ok=True)
+        with open(CHROMEDRIVER_CACHE_FILE, 'w') as file:
+            file.write(path)
+    except OSError as e:
+        logger.warning(f"Could not cache chromedriver path: {e}")
+    return path
+
+def forget_chromedriver_path():
+    # Chrome updates itself; a remembered driver built for the previous version can no longer start a session
+    chromedriver_path.cache_clear()
+    try:
+        os.remove(CHROMEDRIVER_CACHE_FILE)
+    except OSError:
+        pass
+
+class BrowserSession:
+    # One Chrome process plus the bookkeeping needed to decide when it should be recycled
+    def __init__(self, headless=False, window_size='1920,1080', warmup=None, render_timeout=None):
+        self.headless = headless
+        self.window_size = window_size
+        self.warmup = warmup if warmup is not None else os.getenv('BROWSER_WARMUP', 'true').lower() in ('1', 'true', 'yes')
+        # Longest wait for a loaded page to pass its rendered check before the load counts as failed
+        self.render_timeout = float(render_timeout or os.getenv('BROWSER_RENDER_TIMEOUT', 20))
+        self.driver = self.start()
+        self.pages = 0
+        self.baseline_rss = self.rss()
+
+    def start(self):
         chrome_options = Options()
-        # chrome_options.add_argument("--headless")
-        chrome_options.add_argument("--window-size=1920,1080")
+        if self.headless:
+            chrome_options.add_argument("--headless")
+        chrome_options.add_argument(f"--window-size={self.window_size}")
         chrome_options.add_argument("--disable-gpu")
         chrome_options.add_argument("--no-sandbox")
         chrome_options.add_argument("--disable-dev-shm-usage")
-        chrome_options.add_argument(
-            '--user-agent=Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
+        chrome_options.add_argument(f'--user-agent={USER_AGENT}')
+        started = time.monotonic()
         try:
-            service = Service(ChromeDriverManager().install())
-            browser = webdriver.Chrome(options=chrome_options, service=service)
-            browser.get("https://indeed.com")
-            time.sleep(10)
-            print("Browser initialized and opened Indeed homepage.")
-            return browser
-        except Exception as e:
-            print(f"Error initializing browser: {e}")
-            return None
+            driver = webdriver.Chrome(options=chrome_options, service=Service(chromedriver_path()))
+        except SessionNotCreatedException as e:
+            if os.getenv('CHROMEDRIVER_PATH'):
+                raise
+            logger.warning(f"Could not start Chrome with the cached chromedriver, resolving it again: {e}")
+            forget_chromedriver_path()
+            driver = webdriver.Chrome(options=chrome_options, service=Service(chromedriver_path()))
+        if self.warmup:
+            # Pick up the homepage cookies, waiting for the page to finish loading instead of a fixed sleep
+            try:
+                driver.get("https://indeed.com")
+                WebDriverWait(driver, 10).until(
+                    lambda current: current.execute_script('return document.readyState') == 'complete')
+            except TimeoutException:
+                logger.warning("Browser warm-up timed out, continuing without it.")
+            except Exception:
+                # The session is not handed out, so nothing else would ever quit this Chrome
+                driver.quit()
+                raise
+        logger.info(f"Browser session started in {time.monotonic() - started:.1f} s.")
+        return driver
 
-    def get_dom(self, url):
+    def rss(self):
+        # Resident memory of chromedriver and every Chrome process it spawned
         try:
-            self.browser.get(url)
-            time.sleep(5)
-            page_content = self.browser.page_source
-            product_soup = BeautifulSoup(page_content, 'html.parser')
-            dom = et.HTML(str(product_soup))
-            print(f"DOM obtained for URL: {url}")
-            return dom
-        except Exception as e:
-            print(f"Error getting DOM for URL {url}: {e}")
-            return None
+            process = psutil.Process(self.driver.service.process.pid)
+            return sum(child.memory_info().rss for child in [process] + process.children(recursive=True))
+        except (AttributeError, psutil.Error):
+            return 0
+
+    def healthy(self):
+        try:
+            return self.driver.execute_script('return 1') == 1
+        except WebDriverException:
+            return False
+
+    def fetch(self, url, rendered=None):
+        self.driver.get(url)
+        self.pages += 1
+        if rendered is not None:
+            # get() returns at the load event, before a challenge page has redirected or the results have been drawn
+            try:
+                WebDriverWait(self.driver, self.render_timeout).until(lambda driver: rendered(driver.page_source))
+            except TimeoutException:
+                raise RuntimeError(f"Page did not render within {self.render_timeout:.0f} s: {url}")
+        return self.driver.page_source
 
     def close(self):
         try:
-            self.browser.close()
-            print("Browser closed.")
+            self.driver.quit()
         except Exception as e:
-            print(f"Error closing browser: {e}")
+            logger.error(f"Error closing browser session: {e}")
 
-class Job:
-    def __init__(self, job):
-        self.job = job
+class BrowserPool:
+    # Hands out Chrome sessions that are started on first use and reused across searches,
+    # replacing a session after max_pages loads, when its memory grows or when it stops responding
+    def __init__(self, size=1, max_pages=None, max_rss_growth_mb=None, check_every=10, **session_options):
+        self.size = max(1, size)
+        self.max_pages = max_pages if max_pages is not None else int(os.getenv('BROWSER_MAX_PAGES', 200))
+        self.max_rss_growth = (max_rss_growth_mb if max_rss_growth_mb is not None
+                               else float(os.getenv('BROWSER_MAX_RSS_GROWTH_MB', 1024))) * 1024 * 1024
+        self.check_every = check_every
+        self.session_options = session_options
+        self.idle = queue.LifoQueue()
+        self.slots = threading.BoundedSemaphore(self.size)
+        self.lock = threading.Lock()
+        self.sessions = []
+        self.restarts = 0
 
-    def get_job_title(self):
-        try:
-            job_title = self.job.xpath(".//a[contains(@class, 'jcs-JobTitle')]/span/@title")[0]
-        except IndexError:
-            job_title = 'Not available'
-        return job_title
+    def needs_restart(self, session):
+        if self.max_pages and session.pages >= self.max_pages:
+            logger.info(f"Recycling browser session after {session.pages} pages.")
+            return True
+        if self.check_every and session.pages and session.pages % self.check_every == 0:
+            growth = session.rss() - session.baseline_rss
+            if growth > self.max_rss_growth:
+                logger.info(f"Recycling browser session after memory grew by {growth / 1024 / 1024:.0f} MB.")
+                return True
+        return False
 
-    def get_company_name(self):
-        try:
-            company_name = self.job.xpath('.//span[@data-testid="company-name"]/text()')[0].strip()
-        except IndexError:
-            company_name = 'Not available'
-        return company_name
+    def discard(self, session):
+        session.close()
+        with self.lock:
+            self.sessions.remove(session)
 
-    def get_post_date(self):
+    def checkout(self):
+        self.slots.acquire()
         try:
-            # Attempt to extract the posting date using xpath to find the 'date' class and get its text content.
-            # Adjust the xpath as needed if the structure is different.
-            post_date = self.job.xpath('.//span[@class="date"]/text()')[0].strip()
-        except IndexError:
-            # If the span with class 'date' is not found or it doesn't contain any text, return 'Not available'
-            post_date = 'Not available'
-        return post_date
-
-    def get_company_location(self):
-        try:
-            company_location = self.job.xpath('.//div[@data-testid="text-location"]/text()')[0].strip()
-        except IndexError:
-            company_location = 'Not available'
-        return company_location
+            while True:
+                try:
+                    session = self.idle.get_nowait()
+                except queue.Empty:
+                    session = BrowserSession(**self.session_options)
+                    with self.lock:
+                        self.sessions.append(session)
+                    return session
+                if self.needs_restart(session) or not session.healthy():
+                    self.discard(session)
+                    self.restarts += 1
+                    continue
+                return session
+        except Exception:
+            self.slots.release()
+            raise
 
-    def get_job_salary(self):
-        try:
-            job_salary = self.job.xpath('.//div[contains(@class, "salary-snippet-container")]/div[@data-testid="attribute_snippet_testid"]/text()')[0].strip()
-        except IndexError:
-            job_salary = 'Not available'
-        return job_salary
+    def checkin(self, session, broken=False):
+        if broken:
+            self.discard(session)
+            self.restarts += 1
+        else:
+            self.idle.put(session)
+        self.slots.release()
 
-    def get_job_type(self):
+    @contextmanager
+    def session(self):
+        session = self.checkout()
+        broken = False
         try:
-            job_type = self.job.xpath('//div[@class="metadata"]/div[@data-testid="attribute_snippet_testid"][not(ancestor::div[@class="metadata salary-snippet-container"])]/text()')[0].strip()
-        except IndexError:
-            job_type = 'Not available'
-        return job_type
+            yield session
+        except WebDriverException:
+            broken = True
+            raise
+        finally:
+            self.checkin(session, broken)
 
-    def get_job_description(self):
-        try:
-            job_description_parts = self.job.xpath('.//div[@class="job-snippet"]/ul/li/text()')
-            job_description = ' '.join([part.strip() for part in job_description_parts])
-        except IndexError:
-            job_description = 'Not available'
-        return job_description
+    def fetch(self, url, rendered=None):
+        # A session that died mid-load is replaced and the page retried once
+        for attempt in range(2):
+            try:
+                with self.session() as session:
+                    return session.fetch(url, rendered)
+            except WebDriverException as e:
+                if attempt:
+                    raise
+                logger.warning(f"Browser session failed, retrying with a new one: {e}")
+
+    def close(self):
+        with self.lock:
+            sessions, self.sessions = self.sessions, []
+        for session in sessions:
+            session.close()
+        if sessions:
+            logger.info(f"Closed {len(sessions)} browser session(s), {self.restarts} restart(s).")
 
-    def get_job_link(self):
+class Browser:
+    # Consecutive HTTP fallbacks after which the rest of the run goes straight to Selenium
+    MAX_HTTP_FALLBACKS = 3
+
+    def __init__(self, host_limits=None, rate=None, fetcher=None, sanitize=False, archive_dir=None, rate_limiter=None):
+        # Maps a host name to a semaphore shared by all workers fetching from that host
+        self.host_limits = host_limits or {}
+        # Politeness delay between page loads, in pages per second; a scheduler passes one limiter shared by all workers
+        self.rate_limiter = rate_limiter or RateLimiter(rate if rate is not None else float(os.getenv('SCRAPE_RATE', 0.2)))
+        fetcher = fetcher or os.getenv('SCRAPE_FETCHER', 'http')
+        self.http = HttpFetcher() if fetcher == 'http' else None
+        self.selenium = BrowserPool(size=1)
+        self.http_fallbacks = 0
+        # Drop scripts, styles and comments while parsing; only needed for pages lxml chokes on
+        self.sanitize = sanitize
+        # Raw pages kept on disk so extraction can be re-run later without fetching them again
+        archive_dir = archive_dir or os.getenv('SCRAPE_ARCHIVE_DIR')
+        self.archive = PageArchive(archive_dir) if archive_dir else None
+
+    def fetch_page(self, url):
+        if self.http is not None and self.http_fallbacks < self.MAX_HTTP_FALLBACKS:
+            try:
+                with PAGE_FETCH_SECONDS.time(fetcher='http'):
+                    page_content = self.http.fetch(url)
+                if not needs_javascript(page_content):
+                    self.http_fallbacks = 0
+                    return page_content
+                logger.warning(f"Page needs JavaScript, falling back to Selenium: {url}")
+            except requests.RequestException as e:
+                ERRORS_TOTAL.inc(stage='http_fetch')
+                logger.warning(f"HTTP fetch failed, falling back to Selenium: {e}")
+            self.http_fallbacks += 1
+            if self.http_fallbacks == self.MAX_HTTP_FALLBACKS:
+                logger.warning("HTTP fetches keep failing, using Selenium for the rest of the run.")
+        # A page that is still a challenge once the wait runs out raises, so get_dom returns None
+        # and the page is released instead of being stored as an empty result
+        with PAGE_FETCH_SECONDS.time(fetcher='selenium'):
+            return self.selenium.fetch(url, rendered=lambda page_content: not needs_javascript(page_content))
+
+    def get_dom(self, url):
         try:
-            job_link = self.job.xpath(".//a[contains(@class, 'jcs-JobTitle')]/@href")[0]
-        except IndexError:
-            job_link = 'Not available'
-        return job_link
+            self.rate_limiter.acquire()
+            with self.host_limits.get(urlparse(url).netloc) or nullcontext():
+                page_content = self.fetch_page(url)
+            if self.archive is not None:
+                self.archive.store(url, page_content)
+            with PAGE_PARSE_SECONDS.time():
+                dom = parse_page(page_content, sanitize=self.sanitize)
+            PAGES_TOTAL.inc(result='ok')
+            logger.debug("DOM obtained for URL: %s", url)
+            return dom
+        except Exception as e:
+            PAGES_TOTAL.inc(result='error')
+            logger.error(f"Error getting DOM for URL {url}: {e}")
+            return None
+
+    def close(self):
+        if self.http is not None:
+            self.http.close()
+        self.selenium.close()
+        if self.archive is not None:
+            self.archive.close()
+
+JobCard = namedtuple('JobCard', ['job_link', 'post_date', 'job_title', 'company_name', 'job_location',
+                                 'salary', 'job_type', 'job_description', 'data_jk'])
+
+def first_text(element):
+    # Equivalent of text()[0]: the first direct text node, which may follow a child element
+    if element.text is not None:
+        return element.text.strip()
+    for child in element:
+        if child.tail is not None:
+            return child.tail.strip()
+    return None
+
+def direct_texts(element):
+    texts = [element.text] if element.text is not None else []
+    return texts + [child.tail for child in element if child.tail is not None]
+
+class JobCardExtractor:
+    # Compiled once and reused for every page
+    cards_xpath = et.XPath('//div[@class="job_seen_beacon"]')
 
+    def cards(self, dom):
+        return self.cards_xpath(dom)
 
-def scrape_jobs(db, browser, job_keyword, location_keyword, job_search_radius):
-    all_jobs = []
+    def extract(self, card):
+        # Single walk over the card; each field is recognised from the element and its parent,
+        # so the cost is proportional to the card and never touches the rest of the document
+        fields = dict.fromkeys(JobCard._fields)
+        description_parts = []
+        for element in card.iter('a', 'span', 'div', 'li'):
+            tag = element.tag
+            parent = element.getparent()
+            if tag == 'a':
+                if fields['job_link'] is None and 'jcs-JobTitle' in element.get('class', ''):
+                    fields['job_link'] = element.get('href')
+                    fields['data_jk'] = element.get('data-jk')
+                if fields['job_title'] is None and 'jcs-JobTitle' in element.get('class', ''):
+                    fields['job_title'] = next((span.get('title') for span in element
+                                                if span.tag == 'span' and span.get('title') is not None), None)
+            elif tag == 'span':
+                if fields['post_date'] is None and element.get('class') == 'date':
+                    fields['post_date'] = first_text(element)
+                elif fields['company_name'] is None and element.get('data-testid') == 'company-name':
+                    fields['company_name'] = first_text(element)
+            elif tag == 'div':
+                testid = element.get('data-testid')
+                if testid == 'text-location':
+                    if fields['job_location'] is None:
+                        fields['job_location'] = first_text(element)
+                elif testid == 'attribute_snippet_testid' and parent is not None and parent.tag == 'div':
+                    parent_class = parent.get('class', '')
+                    if fields['salary'] is None and 'salary-snippet-container' in parent_class:
+                        fields['salary'] = first_text(element)
+                    elif fields['job_type'] is None and parent_class == 'metadata':
+                        fields['job_type'] = first_text(element)
+            elif parent is not None and parent.tag == 'ul':
+                snippet = parent.getparent()
+                if snippet is not None and snippet.tag == 'div' and snippet.get('class') == 'job-snippet':
+                    description_parts.extend(part.strip() for part in direct_texts(element))
+        fields['job_description'] = ' '.join(description_parts)
+        # The data-jk attribute is only a fallback key, so a missing one stays None
+        return JobCard(**{name: 'Not available' if value is None and name != 'data_jk' else value
+                          for name, value in fields.items()})
+
+job_card_extractor = JobCardExtractor()
+
+def extract_cards(dom):
+    return [job_card_extractor.extract(card) for card in job_card_extractor.cards(dom)]
+
+# How often a run waiting on a page another run is fetching checks whether it finished
+UNIT_POLL_SECONDS = 2
+
+def job_key(job_link, data_jk=None):
+    # Indeed identifies a posting by the jk query parameter of its link; sponsored /pagead/clk links
+    # carry no jk, but the card's anchor still has it in data-jk
+    keys = parse_qs(urlparse(job_link).query).get('jk')
+    return keys[0] if keys else data_jk or None
+
+def job_record(card, job_keyword, scraped_at):
+    # Row in JobDatabase.COLUMNS order
+    return (card.post_date, base_url + card.job_link, card.job_title, card.job_location, card.company_name,
+            card.salary, card.job_description, card.job_type, job_keyword, scraped_at, job_key(card.job_link, card.data_jk),
+            [job_keyword])
+
+def scrape_jobs(db, browser, job_keyword, location_keyword, job_search_radius, incremental=False):
+    started_at = datetime.now()
+    if incremental:
+        high_water_mark, seen_keys = db.load_seen_keys(job_keyword, location_keyword)
+        logger.info(f"Incremental mode: {len(seen_keys)} known jobs, last run at {high_water_mark}")
+    else:
+        seen_keys = set()
+    new_keys = set()
+    jobs_scraped = 0
+    truncated = False
     for page_no in range(0, 100, 10):
-        print(f"Scraping page number: {page_no//10 + 1}")
+        logger.debug("Scraping page number: %d", page_no // 10 + 1)
+        unit = (job_keyword, location_keyword, job_search_radius, page_no)
+        state, card_count = db.claim_unit(*unit)
+        while state == 'running':
+            # Another run is fetching this exact page; wait for its result instead of loading it twice
+            time.sleep(UNIT_POLL_SECONDS)
+            state, card_count = db.claim_unit(*unit)
+        if state == 'done':
+            UNITS_TOTAL.inc(source='shared')
+            logger.info(f"Page already scraped by another run ({card_count} jobs), skipping.")
+            if not card_count:
+                logger.info("No job cards on page, stopping pagination.")
+                break
+            continue
         url = pagination_url.format(job_keyword, location_keyword, job_search_radius, page_no)
+        UNITS_TOTAL.inc(source='fetched')
         page_dom = browser.get_dom(url)
-        jobs = page_dom.xpath('//div[@class="job_seen_beacon"]')
-        all_jobs = all_jobs + jobs
-    for job in all_jobs:
-        print("Processing a job...")
-        job_obj = Job(job)
-        job_link = base_url + job_obj.get_job_link()
-        print(f"Job Link: {job_link}")
-        time.sleep(2)
-        post_date = job_obj.get_post_date()
-        print(f"Job Post Info: {post_date}")
-        job_title = job_obj.get_job_title()
-        print(f"Job Title: {job_title}")
-        time.sleep(2)
-        company_name = job_obj.get_company_name()
-        print(f"Company Name: {company_name}")
-        time.sleep(2)
-        job_location = job_obj.get_company_location()
-        print(f"Company Location: {job_location}")
-        time.sleep(2)
-        salary = job_obj.get_job_salary()
-        print(f"Salary: {salary}")
-        time.sleep(2)
-        job_type = job_obj.get_job_type()
-        print(f"Job Type: {job_type}")
-        time.sleep(2)
-        job_desc = job_obj.get_job_description()
-        print(f"Job Description: {job_desc[:50]}...")  # printing first 50 characters
-        time.sleep(2)
-        record = (post_date, job_link, job_title, job_location, company_name, salary, job_desc, job_type, job_keyword, datetime.now())
-        db.insert_record(record)
-        print("Job processed and data written to database.")
+        if page_dom is None:
+            # get_dom has logged why; the page goes back to other runs and this search ends here
+            db.release_unit(*unit)
+            logger.error(f"Could not load {url}, stopping pagination for {job_keyword} in {location_keyword}.")
+            truncated = True
+            break
+        try:
+            with EXTRACT_SECONDS.time():
+                cards = extract_cards(page_dom)
+        except Exception:
+            ERRORS_TOTAL.inc(stage='extract')
+            db.release_unit(*unit)
+            raise
+        CARDS_TOTAL.inc(len(cards))
+        if not cards:
+            db.complete_unit(*unit, 0)
+            logger.info("No job cards on page, stopping pagination.")
+            break
+        keys = [job_key(card.job_link, card.data_jk) for card in cards]
+        # Results are sorted by date, so once a whole page is known the rest was stored by an earlier run;
+        # cards without a key can never be known and do not count either way
+        known = [key for key in keys if key is not None]
+        if incremental and known and all(key in seen_keys for key in known):
+            db.complete_unit(*unit, len(cards))
+            logger.info("All jobs on page were already scraped, stopping pagination.")
+            break
+        for card, key in zip(cards, keys):
+            if key is not None and (key in seen_keys or key in new_keys):
+                JOBS_TOTAL.inc(result='skipped')
+                continue
+            record = job_record(card, job_keyword, datetime.now())
+            logger.debug("Job %s: %s at %s, %s, posted %s, salary %s, %s: %.50s...", record[1], card.job_title,
+                         card.company_name, card.job_location, card.post_date, card.salary, card.job_type,
+                         card.job_description)
+            db.insert_record(record)
+            if key is not None:
+                new_keys.add(key)
+            JOBS_TOTAL.inc(result='stored')
+            jobs_scraped += 1
+        db.complete_unit(*unit, len(cards))
+    if truncated:
+        # Marking these keys seen would let the next incremental run stop before the pages this one missed
+        logger.warning(f"Not recording seen jobs for {job_keyword} in {location_keyword}, the search was cut short.")
+    else:
+        db.mark_seen(job_keyword, location_keyword, new_keys, started_at)
+    return jobs_scraped
+
+ScrapeResult = namedtuple('ScrapeResult', ['worker_id', 'job_keyword', 'location_keyword', 'jobs', 'elapsed', 'error'])
+
+def scrape_worker(worker_id, tasks, results, job_search_radius, browser_options, incremental=False):
+    # Each worker owns its browser and database writer and pulls searches until it receives None
+    metrics.start_snapshots('scrape-worker')
+    db = JobDatabase()
+    browser = Browser(**browser_options)
+    try:
+        for job_keyword, location_keyword in iter(tasks.get, None):
+            logger.info(f"Worker {worker_id} searching for {job_keyword} in {location_keyword}")
+            started = time.monotonic()
+            try:
+                with SEARCH_SECONDS.time():
+                    jobs = scrape_jobs(db, browser, job_keyword, location_keyword, job_search_radius, incremental)
+                results.put(ScrapeResult(worker_id, job_keyword, location_keyword, jobs, time.monotonic() - started, None))
+            except Exception as e:
+                ERRORS_TOTAL.inc(stage='search')
+                logger.error(f"Worker {worker_id} failed on {job_keyword} in {location_keyword}: {e}")
+                results.put(ScrapeResult(worker_id, job_keyword, location_keyword, 0, time.monotonic() - started, str(e)))
+    finally:
+        browser.close()
+        db.close()
+        # Worker processes exit without running atexit hooks, so their last counts and lines are written here
+        metrics.write_snapshot()
+        flush_logging()
+
+class ScrapeScheduler:
+    def __init__(self, workers=1, max_per_host=2, job_search_radius=100, incremental=False, progress_file=None,
+                 **browser_options):
+        self.workers = max(1, workers)
+        self.incremental = incremental
+        # JSON file rewritten after every finished search so a caller can follow a long run
+        self.progress_file = progress_file
+        # Passed through to each worker's Browser (rate, fetcher, sanitize, archive_dir)
+        self.browser_options = browser_options
+        self.max_per_host = max(1, max_per_host)
+        self.job_search_radius = job_search_radius
+
+    def run(self, job_keywords, location_keywords):
+        # Repeated keywords would only queue the same search twice
+        searches = list(itertools.product(dict.fromkeys(job_keywords), dict.fromkeys(location_keywords)))
+        workers = min(self.workers, len(searches))
+        tasks = multiprocessing.Queue()
+        results = multiprocessing.Queue()
+        # --rate is the politeness budget of the whole run, however many workers share it
+        rate = self.browser_options.get('rate')
+        browser_options = dict(
+            self.browser_options,
+            host_limits={urlparse(base_url).netloc: multiprocessing.BoundedSemaphore(self.max_per_host)},
+            rate_limiter=SharedRateLimiter(rate if rate is not None else float(os.getenv('SCRAPE_RATE', 0.2)))
+        )
+        for search in searches:
+            tasks.put(search)
+        for _ in range(workers):
+            tasks.put(None)
+
+        started = time.monotonic()
+        processes = []
+        self.write_progress(searches, [], started)
+        if workers == 1:
+            # A single worker runs in-process, which keeps the serial behaviour of earlier versions;
+            # the thread only lets this loop report each search as it finishes
+            thread = threading.Thread(
+                target=scrape_worker,
+                args=(0, tasks, results, self.job_search_radius, browser_options, self.incremental),
+                name="scrape-worker-0"
+            )
+            thread.start()
+            processes.append(thread)
+        else:
+            for worker_id in range(workers):
+                process = multiprocessing.Process(
+                    target=scrape_worker,
+                    args=(worker_id, tasks, results, self.job_search_radius, browser_options, self.incremental),
+                    name=f"scrape-worker-{worker_id}"
+                )
+                process.start()
+                processes.append(process)
+            logger.info(f"Started {workers} scrape workers for {len(searches)} searches.")
+
+        completed = []
+        while len(completed) < len(searches):
+            try:
+                result = results.get(timeout=5)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    logger.error("All scrape workers exited before finishing the search grid.")
+                    break
+                continue
+            completed.append(result)
+            status = f"failed: {result.error}" if result.error else f"{result.jobs} jobs"
+            logger.info(f"[{len(completed)}/{len(searches)}] {result.job_keyword} in {result.location_keyword}: "
+                        f"{status} ({result.elapsed:.0f}s, worker {result.worker_id})")
+            self.write_progress(searches, completed, started)
+
+        for process in processes:
+            process.join()
+        return self.summarize(searches, completed, time.monotonic() - started)
+
+    def write_progress(self, searches, completed, started):
+        if not self.progress_file:
+            return
+        last = completed[-1] if completed else None
+        progress = {
+            'searches': len(searches),
+            'completed': sum(1 for result in completed if not result.error),
+            'failed': sum(1 for result in completed if result.error),
+            'jobs': sum(result.jobs for result in completed),
+            'elapsed': time.monotonic() - started,
+            'last_search': f"{last.job_keyword} in {last.location_keyword}" if last else None,
+        }
+        try:
+            # Written next to the target and renamed so readers never see a half-written file
+            temporary = f"{self.progress_file}.tmp"
+            with open(temporary, 'w') as file:
+                json.dump(progress, file)
+            os.replace(temporary, self.progress_file)
+        except OSError as e:
+            logger.warning(f"Could not write progress file: {e}")
+
+    def summarize(self, searches, completed, elapsed):
+        failed = [result for result in completed if result.error]
+        per_worker = Counter(result.worker_id for result in completed)
+        summary = {
+            'searches': len(searches),
+            'completed': len(completed) - len(failed),
+            'failed': len(failed),
+            'missing': len(searches) - len(completed),
+            'jobs': sum(result.jobs for result in completed),
+            'elapsed': elapsed,
+        }
+        logger.info(f"Scrape summary: {summary['completed']}/{summary['searches']} searches completed, "
+                    f"{summary['failed']} failed, {summary['missing']} not run, "
+                    f"{summary['jobs']} jobs in {elapsed / 60:.1f} min.")
+        for worker_id, count in sorted(per_worker.items()):
+            logger.info(f"  worker {worker_id}: {count} searches")
+        for result in failed:
+            logger.info(f"  failed: {result.job_keyword} in {result.location_keyword}: {result.error}")
+        return summary
 
 def main():
     
@@ -245,29 +1061,46 @@ def main():
     # Add command-line arguments
     parser.add_argument('--location', nargs='+', help='Location(s) for job search', default=location_search_keyword)
     parser.add_argument('--position', nargs='+', help='Position(s) for job search', default=job_search_keyword)
+    parser.add_argument('--workers', type=int, help='Number of parallel browser workers',
+                        default=int(os.getenv('SCRAPE_WORKERS', 1)))
+    parser.add_argument('--max-per-host', type=int, help='Maximum concurrent page loads per host across workers',
+                        default=int(os.getenv('SCRAPE_MAX_PER_HOST', 2)))
+    parser.add_argument('--rate', type=float, help='Page loads per second allowed across all workers (0 disables the limit)',
+                        default=float(os.getenv('SCRAPE_RATE', 0.2)))
+    parser.add_argument('--fetcher', choices=['http', 'selenium'],
+                        help='Page fetcher; http falls back to Selenium for pages that need JavaScript',
+                        default=os.getenv('SCRAPE_FETCHER', 'http'))
+    parser.add_argument('--sanitize', action='store_true',
+                        help='Strip scripts, styles and comments while parsing pages')
+    parser.add_argument('--incremental', action='store_true',
+                        default=os.getenv('SCRAPE_INCREMENTAL', '').lower() in ('1', 'true', 'yes'),
+                        help='Stop paginating a search once a page only has jobs stored by earlier runs')
+    parser.add_argument('--archive', default=os.getenv('SCRAPE_ARCHIVE_DIR'),
+                        help='Directory where every fetched page is archived for later replay (default off)')
+    parser.add_argument('--progress-file', help='JSON file updated with search progress while the run is going')
+    parser.add_argument('--metrics-port', type=int, default=int(os.getenv('METRICS_PORT', 0) or 0),
+                        help='Serve Prometheus metrics on this port while the run is going (0 disables)')
 
     # Parse the command-line arguments
     args = parser.parse_args()
-    
+
+    metrics.start_snapshots('scrape')
+    metrics.start_http_server(args.metrics_port)
     try:
         telebot_notifier.send_notification("Script started")
-        db = JobDatabase()
-        browser = Browser()
-
-        # Iterate through the provided positions and locations
-        for job_keyword in args.position:
-            print(f"Searching for job keyword: {job_keyword}")
-            for location_keyword in args.location:
-                print(f"Searching in location: {location_keyword}")
-                scrape_jobs(db, browser, job_keyword, location_keyword, job_search_radius)
-
-        browser.close()
-        db.close()
-        telebot_notifier.send_notification("Script finished successfully")
+        scheduler = ScrapeScheduler(workers=args.workers, max_per_host=args.max_per_host,
+                                    job_search_radius=job_search_radius, incremental=args.incremental,
+                                    progress_file=args.progress_file, rate=args.rate, fetcher=args.fetcher,
+                                    sanitize=args.sanitize, archive_dir=args.archive)
+        # Fan the position x location grid out across the worker pool
+        summary = scheduler.run(args.position, args.location)
+        telebot_notifier.send_notification(
+            f"Script finished: {summary['completed']}/{summary['searches']} searches, "
+            f"{summary['failed']} failed, {summary['jobs']} jobs in {summary['elapsed'] / 60:.1f} min")
 
     except Exception as e:
         error_message = f"An error occurred: {e}"
-        print(error_message)
+        logger.error(error_message)
         telebot_notifier.send_notification(error_message)
 
 job_search_radius = 100  # in miles
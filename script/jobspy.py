@@ -1,22 +1,25 @@
+import logging
 import os
-import time
 from datetime import datetime
-from random import randrange
 
 import dotenv
-import psycopg2
 import telebot
 from PyInquirer import prompt
-from bs4 import BeautifulSoup
-from lxml import etree as et
 from selenium import webdriver
+from selenium.common.exceptions import TimeoutException
 from selenium.webdriver.chrome.options import Options
 from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.support.ui import WebDriverWait
 from webdriver_manager.chrome import ChromeDriverManager
 
+from job_scrapping import JobDatabase, RateLimiter, job_key, needs_javascript, parse_page
+from logging_setup import setup_logging
+
 dotenv.load_dotenv()
+setup_logging()
+logger = logging.getLogger('jobspy')
 
-print("Loaded environment variables.")
+logger.info("Loaded environment variables.")
 
 
 class TelebotNotifier:
@@ -28,70 +31,17 @@ class TelebotNotifier:
     def send_notification(self, message):
         try:
             self.bot.send_message(self.chat_id, message)
-            print(f"Notification sent: {message}")
+            logger.info(f"Notification sent: {message}")
         except Exception as e:
-            print(f"Failed to send notification. Error: {e}")
-
-
-class JobDatabase:
-    def __init__(self):
-        try:
-            self.conn = psycopg2.connect(
-                dbname=os.getenv('DB_NAME'),
-                user=os.getenv('DB_USER'),
-                password=os.getenv('DB_PASSWORD'),
-                host=os.getenv('DB_HOST'),
-                port=os.getenv('DB_PORT')
-            )
-            print("Database connection established.")
-            self.create_table()
-            print("Database table checked/created.")
-        except Exception as e:
-            print(f"Error connecting to the database: {e}")
-
-    def create_table(self):
-        with self.conn.cursor() as cur:
-            try:
-                cur.execute(f"CREATE TABLE IF NOT EXISTS {os.getenv('DB_TABLE_NAME')} ("
-                            "id SERIAL PRIMARY KEY,"
-                            "post_date TEXT,"
-                            "job_link TEXT,"
-                            "job_title TEXT,"
-                            "job_location TEXT,"
-                            "company_name TEXT,"
-                            "salary TEXT,"
-                            "job_description TEXT,"
-                            "job_type TEXT,"
-                            "job_keyword TEXT,"
-                            "scrap_time TIMESTAMPTZ"
-                            ")")
-                self.conn.commit()
-                print("Database table created/exists.")
-            except Exception as e:
-                print(f"Error creating/checking table: {e}")
-
-    def insert_record(self, record):
-        with self.conn.cursor() as cur:
-            try:
-                cur.execute(f'''
-                INSERT INTO {os.getenv('DB_TABLE_NAME')} (post_date, job_link, job_title, job_location, company_name, salary, job_description, job_type, job_keyword, scrap_time)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                ''', record)
-                self.conn.commit()
-                print("Record inserted into database.")
-            except Exception as e:
-                print(f"Error inserting record into database: {e}")
-
-    def close(self):
-        try:
-            self.conn.close()
-            print("Database connection closed.")
-        except Exception as e:
-            print(f"Error closing database connection: {e}")
+            logger.error(f"Failed to send notification. Error: {e}")
 
 
 class Browser:
-    def __init__(self):
+    def __init__(self, rate=None):
+        # Politeness delay between page loads in pages per second, the same SCRAPE_RATE job_scrapping.py uses
+        self.rate_limiter = RateLimiter(rate if rate is not None else float(os.getenv('SCRAPE_RATE', 0.2)))
+        # Longest wait for a loaded page to render past any challenge
+        self.render_timeout = float(os.getenv('BROWSER_RENDER_TIMEOUT', 20))
         self.browser = self.get_browser()
 
     def get_browser(self):
@@ -107,32 +57,37 @@ class Browser:
             service = Service(ChromeDriverManager().install())
             browser = webdriver.Chrome(options=chrome_options, service=service)
             browser.get("https://indeed.com")
-            time.sleep(10)
-            print("Browser initialized and opened Indeed homepage.")
+            WebDriverWait(browser, 10).until(
+                lambda current: current.execute_script('return document.readyState') == 'complete')
+            logger.info("Browser initialized and opened Indeed homepage.")
             return browser
         except Exception as e:
-            print(f"Error initializing browser: {e}")
+            logger.error(f"Error initializing browser: {e}")
             return None
 
     def get_dom(self, url):
         try:
+            self.rate_limiter.acquire()
             self.browser.get(url)
-            time.sleep(randrange(10))
-            page_content = self.browser.page_source
-            product_soup = BeautifulSoup(page_content, 'html.parser')
-            dom = et.HTML(str(product_soup))
-            print(f"DOM obtained for URL: {url}")
+            # Wait until the results are drawn; a page still on a challenge times out and is not parsed
+            WebDriverWait(self.browser, self.render_timeout).until(
+                lambda current: not needs_javascript(current.page_source))
+            dom = parse_page(self.browser.page_source)
+            logger.debug("DOM obtained for URL: %s", url)
             return dom
+        except TimeoutException:
+            logger.error(f"Page did not render within {self.render_timeout:.0f} s: {url}")
+            return None
         except Exception as e:
-            print(f"Error getting DOM for URL {url}: {e}")
+            logger.error(f"Error getting DOM for URL {url}: {e}")
             return None
 
     def close(self):
         try:
             self.browser.close()
-            print("Browser closed.")
+            logger.info("Browser closed.")
         except Exception as e:
-            print(f"Error closing browser: {e}")
+            logger.error(f"Error closing browser: {e}")
 
 
 class Job:
@@ -203,45 +158,50 @@ class Job:
             job_link = 'Not available'
         return job_link
 
+    def get_data_jk(self):
+        # Job key on the title anchor, for sponsored links that carry no jk parameter
+        try:
+            data_jk = self.job.xpath(".//a[contains(@class, 'jcs-JobTitle')]/@data-jk")[0]
+        except IndexError:
+            data_jk = None
+        return data_jk
+
 
 def scrape_jobs(db, browser, job_keyword, location_keyword, job_search_radius):
     all_jobs = []
     for page_no in range(0, 100, 10):
-        print(f"Scraping page number: {page_no // 10 + 1}")
+        logger.debug("Scraping page number: %d", page_no // 10 + 1)
         url = pagination_url.format(job_keyword, location_keyword, job_search_radius, page_no)
         page_dom = browser.get_dom(url)
+        if page_dom is None:
+            logger.error(f"Could not load {url}, stopping pagination for {job_keyword} in {location_keyword}.")
+            break
         jobs = page_dom.xpath('//div[@class="job_seen_beacon"]')
         all_jobs = all_jobs + jobs
     for job in all_jobs:
-        print("Processing a job...")
+        logger.debug("Processing a job...")
         job_obj = Job(job)
         job_link = base_url + job_obj.get_job_link()
-        print(f"Job Link: {job_link}")
-        time.sleep(1)
+        logger.debug("Job Link: %s", job_link)
         post_date = job_obj.get_post_date()
-        print(f"Job Post Info: {post_date}")
+        logger.debug("Job Post Info: %s", post_date)
         job_title = job_obj.get_job_title()
-        print(f"Job Title: {job_title}")
-        time.sleep(1)
+        logger.debug("Job Title: %s", job_title)
         company_name = job_obj.get_company_name()
-        print(f"Company Name: {company_name}")
-        time.sleep(1)
+        logger.debug("Company Name: %s", company_name)
         job_location = job_obj.get_company_location()
-        print(f"Company Location: {job_location}")
-        time.sleep(1)
+        logger.debug("Company Location: %s", job_location)
         salary = job_obj.get_job_salary()
-        print(f"Salary: {salary}")
-        time.sleep(1)
+        logger.debug("Salary: %s", salary)
         job_type = job_obj.get_job_type()
-        print(f"Job Type: {job_type}")
-        time.sleep(1)
+        logger.debug("Job Type: %s", job_type)
         job_desc = job_obj.get_job_description()
-        print(f"Job Description: {job_desc[:100]}...")  # printing first 50 characters
-        time.sleep(1)
+        logger.debug("Job Description: %.100s...", job_desc)
+        # Same columns and job key as job_scrapping.py, so repeat sightings are merged into one row
         record = (post_date, job_link, job_title, job_location, company_name, salary, job_desc, job_type, job_keyword,
-                  datetime.now())
+                  datetime.now(), job_key(job_link, job_obj.get_data_jk()), [job_keyword])
         db.insert_record(record)
-        print("Job processed and data written to database.")
+        logger.debug("Job processed and data written to database.")
 
 
 def main():
@@ -280,6 +240,8 @@ def main():
     location_keywords = answers['locations']
     job_search_radius = int(answers['radius'])
 
+    db = None
+    browser = None
     try:
         telebot_notifier.send_notification("Script started")
         db = JobDatabase()
@@ -287,19 +249,23 @@ def main():
 
         # Iterate through the provided positions and locations
         for job_keyword in job_keywords:
-            print(f"Searching for job keyword: {job_keyword}")
+            logger.info(f"Searching for job keyword: {job_keyword}")
             for location_keyword in location_keywords:
-                print(f"Searching in location: {location_keyword}")
+                logger.info(f"Searching in location: {location_keyword}")
                 scrape_jobs(db, browser, job_keyword, location_keyword, job_search_radius)
 
-        browser.close()
-        db.close()
         telebot_notifier.send_notification("Script finished successfully")
 
     except Exception as e:
         error_message = f"An error occurred: {e}"
-        print(error_message)
+        logger.error(error_message)
         telebot_notifier.send_notification(error_message)
+    finally:
+        # Records still buffered when a search fails are written before the run exits
+        if browser is not None:
+            browser.close()
+        if db is not None:
+            db.close()
 
 
 # job_search_radius = 100  # in miles
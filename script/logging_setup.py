@@ -0,0 +1,80 @@
+import atexit
+import logging
+import os
+import queue
+import sys
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_FORMAT = '%(asctime)s %(levelname)s %(processName)s %(name)s: %(message)s'
+
+class SampledDebugFilter(logging.Filter):
+    # Everything at INFO and above passes; DEBUG records pass once every `every` calls per call site,
+    # so turning on debug output for a large run does not flood the log
+    def __init__(self, every=1):
+        super().__init__()
+        self.every = max(1, every)
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.every == 1:
+            return True
+        site = (record.pathname, record.lineno)
+        with self.lock:
+            count = self.counts.get(site, 0)
+            self.counts[site] = count + 1
+        return count % self.every == 0
+
+logging_state = {'listener': None, 'pid': None, 'atexit': False}
+
+def setup_logging(level=None):
+    # Records are handed to a queue and written by a listener thread, so callers never wait on the terminal
+    # or a pipe; configured once per process
+    if logging_state['pid'] == os.getpid():
+        return
+    level = (level or os.getenv('LOG_LEVEL', 'INFO')).upper()
+    formatter = logging.Formatter(LOG_FORMAT)
+    handlers = [logging.StreamHandler(sys.stdout)]
+    if os.getenv('LOG_FILE'):
+        handlers.append(logging.FileHandler(os.getenv('LOG_FILE')))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(SampledDebugFilter(int(os.getenv('LOG_DEBUG_SAMPLE', 20))))
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(level)
+
+    listener = QueueListener(log_queue, *handlers)
+    listener.start()
+    logging_state.update(listener=listener, pid=os.getpid())
+    if not logging_state['atexit']:
+        atexit.register(stop_logging)
+        logging_state['atexit'] = True
+
+def stop_logging():
+    # Drains the queue at interpreter exit
+    listener = logging_state['listener']
+    if listener is None or logging_state['pid'] != os.getpid():
+        return
+    listener.stop()
+    logging_state.update(listener=None, pid=None)
+
+def flush_logging():
+    # Writes out everything queued so far and keeps logging; for worker processes about to exit
+    listener = logging_state['listener']
+    if listener is None or logging_state['pid'] != os.getpid():
+        return
+    listener.stop()
+    listener.start()
+
+def restart_in_child():
+    # A forked worker inherits the queue but not the listener thread that drains it
+    if logging_state['pid'] is not None:
+        logging_state.update(listener=None, pid=None)
+        setup_logging(logging.getLevelName(logging.getLogger().level))
+
+os.register_at_fork(after_in_child=restart_in_child)
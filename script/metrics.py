@@ -0,0 +1,314 @@
+import atexit
+import fcntl
+import glob
+import json
+import logging
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger('metrics')
+
+# Seconds; spans a cached lookup up to a slow Selenium page load
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, math.inf)
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [{'labels': list(key), 'value': value} for key, value in self.values.items()]
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self.lock = threading.Lock()
+        # Per label set: [count per bucket (non-cumulative), sum, count]
+        self.values = {}
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(label, '')) for label in self.labels)
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self.lock:
+            state = self.values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self.lock:
+            return [{'labels': list(key), 'buckets': list(buckets), 'sum': total, 'count': count}
+                    for key, (buckets, total, count) in self.values.items()]
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def register(self, metric_class, name, help_text, labels=(), **options):
+        # Modules may ask for the same metric more than once; they all share the first instance
+        with self.lock:
+            if name not in self.metrics:
+                self.metrics[name] = metric_class(name, help_text, labels, **options)
+            return self.metrics[name]
+
+    def reset(self):
+        with self.lock:
+            for metric in self.metrics.values():
+                with metric.lock:
+                    metric.values.clear()
+
+    def snapshot(self):
+        with self.lock:
+            metrics = list(self.metrics.values())
+        snapshot = {}
+        for metric in metrics:
+            entry = {'type': metric.kind, 'help': metric.help_text, 'labels': list(metric.labels),
+                     'samples': metric.samples()}
+            if metric.kind == 'histogram':
+                entry['buckets'] = [str(bound) for bound in metric.buckets]
+            snapshot[metric.name] = entry
+        return snapshot
+
+registry = Registry()
+
+def counter(name, help_text, labels=()):
+    return registry.register(Counter, name, help_text, labels)
+
+def histogram(name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+    return registry.register(Histogram, name, help_text, labels, buckets=buckets)
+
+def merge(snapshots):
+    # Sums counters and histogram buckets from several processes into one snapshot
+    merged = {}
+    for snapshot in snapshots:
+        for name, entry in snapshot.items():
+            target = merged.setdefault(name, dict(entry, samples=[]))
+            by_labels = {tuple(sample['labels']): sample for sample in target['samples']}
+            for sample in entry['samples']:
+                existing = by_labels.get(tuple(sample['labels']))
+                if existing is None:
+                    sample = json.loads(json.dumps(sample))
+                    target['samples'].append(sample)
+                    by_labels[tuple(sample['labels'])] = sample
+                elif entry['type'] == 'counter':
+                    existing['value'] += sample['value']
+                else:
+                    existing['buckets'] = [a + b for a, b in zip(existing['buckets'], sample['buckets'])]
+                    existing['sum'] += sample['sum']
+                    existing['count'] += sample['count']
+    return merged
+
+def format_labels(names, values, extra=()):
+    pairs = [(name, value) for name, value in zip(names, values) if value != ''] + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+def render(snapshot):
+    # Prometheus text exposition format
+    lines = []
+    for name, entry in sorted(snapshot.items()):
+        lines.append(f"# HELP {name} {entry['help']}")
+        lines.append(f"# TYPE {name} {entry['type']}")
+        for sample in entry['samples']:
+            if entry['type'] == 'counter':
+                lines.append(f"{name}{format_labels(entry['labels'], sample['labels'])} {sample['value']}")
+                continue
+            cumulative = 0
+            for bound, count in zip(entry['buckets'], sample['buckets']):
+                cumulative += count
+                le = '+Inf' if bound == 'inf' else bound
+                lines.append(f"{name}_bucket{format_labels(entry['labels'], sample['labels'], [('le', le)])} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(entry['labels'], sample['labels'])} {sample['sum']}")
+            lines.append(f"{name}_count{format_labels(entry['labels'], sample['labels'])} {sample['count']}")
+    return '\n'.join(lines) + '\n'
+
+# Snapshots of processes that have exited are folded into this file by compact()
+TOTALS_FILE = 'totals.json'
+
+def collect(snapshot_dir=None, include_local=True, compact_finished=False):
+    # This process's metrics plus the snapshot files other processes left in snapshot_dir
+    if snapshot_dir and compact_finished:
+        compact(snapshot_dir)
+    snapshots = [registry.snapshot()] if include_local else []
+    paths = glob.glob(os.path.join(snapshot_dir, '*.json')) if snapshot_dir else []
+    loaded = {}
+    for path in paths:
+        # This process's own file only holds an older copy of its live registry
+        if include_local and path == snapshot_path():
+            continue
+        try:
+            with open(path) as file:
+                loaded[os.path.basename(path)] = json.load(file)
+        except (OSError, ValueError):
+            continue
+    # A file already folded into the totals may still be there if compaction was interrupted before deleting it
+    folded = set(loaded.get(TOTALS_FILE, {}).get('folded', []))
+    for name, snapshot in loaded.items():
+        if name not in folded and 'metrics' in snapshot:
+            snapshots.append(snapshot['metrics'])
+    return merge(snapshots)
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        # Exists but belongs to another user
+        return True
+    return True
+
+def compact(snapshot_dir, stale_seconds=None):
+    # Folds the snapshots of finished processes into one totals file and deletes them, so the number of files
+    # /metrics reads stays bounded by the processes running now instead of growing with every run
+    stale_seconds = stale_seconds or float(os.getenv('METRICS_STALE_SECONDS', 600))
+    totals_path = os.path.join(snapshot_dir, TOTALS_FILE)
+    try:
+        # /metrics can be scraped before any run has created the directory
+        os.makedirs(snapshot_dir, exist_ok=True)
+        with open(os.path.join(snapshot_dir, 'totals.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(totals_path) as file:
+                    totals = json.load(file)
+            except (OSError, ValueError):
+                totals = {'metrics': {}, 'folded': []}
+            folded = set(totals.get('folded', []))
+            finished = []
+            for path in glob.glob(os.path.join(snapshot_dir, '*.json')):
+                name = os.path.basename(path)
+                if name == TOTALS_FILE or path == snapshot_path():
+                    continue
+                if name in folded:
+                    os.remove(path)
+                    continue
+                try:
+                    with open(path) as file:
+                        snapshot = json.load(file)
+                except (OSError, ValueError):
+                    continue
+                # A process that stopped writing long ago is gone even if its pid has been reused
+                if process_alive(snapshot.get('pid', 0)) and time.time() - snapshot.get('written_at', 0) < stale_seconds:
+                    continue
+                finished.append((path, snapshot['metrics']))
+            if not finished:
+                return
+            merged = merge([totals.get('metrics', {})] + [metrics for _, metrics in finished])
+            temporary = f"{totals_path}.tmp"
+            with open(temporary, 'w') as file:
+                json.dump({'role': 'totals', 'written_at': time.time(), 'metrics': merged,
+                           'folded': [os.path.basename(path) for path, _ in finished]}, file)
+            os.replace(temporary, totals_path)
+            for path, _ in finished:
+                os.remove(path)
+            logger.debug("Folded %d finished metrics snapshots into the totals.", len(finished))
+    except OSError as e:
+        logger.warning(f"Could not compact metrics snapshots: {e}")
+
+snapshot_state = {'path': None, 'role': None, 'pid': None}
+
+def snapshot_path():
+    return snapshot_state['path']
+
+def forget_parent():
+    # A forked worker starts from zero; whatever the parent counted is reported by the parent
+    registry.reset()
+    snapshot_state.update(path=None, role=None, pid=None)
+
+os.register_at_fork(after_in_child=forget_parent)
+
+def write_snapshot():
+    path = snapshot_path()
+    if path is None:
+        return
+    try:
+        temporary = f"{path}.tmp"
+        with open(temporary, 'w') as file:
+            json.dump({'role': snapshot_state['role'], 'pid': os.getpid(), 'written_at': time.time(),
+                       'metrics': registry.snapshot()}, file)
+        os.replace(temporary, path)
+    except OSError as e:
+        logger.warning(f"Could not write metrics snapshot: {e}")
+
+def start_snapshots(role, snapshot_dir=None, interval=None):
+    # Periodic JSON snapshot of this process's metrics, one file per process, when METRICS_DIR is set
+    snapshot_dir = snapshot_dir or os.getenv('METRICS_DIR')
+    if not snapshot_dir or snapshot_state['pid'] == os.getpid():
+        return
+    interval = interval or float(os.getenv('METRICS_SNAPSHOT_SECONDS', 15))
+    os.makedirs(snapshot_dir, exist_ok=True)
+    snapshot_state['role'] = role
+    snapshot_state['pid'] = os.getpid()
+    snapshot_state['path'] = os.path.join(snapshot_dir, f"{role}-{os.getpid()}-{int(time.time())}.json")
+
+    def loop():
+        while True:
+            time.sleep(interval)
+            write_snapshot()
+
+    threading.Thread(target=loop, name='metrics-snapshots', daemon=True).start()
+    atexit.register(write_snapshot)
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    snapshot_dir = None
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            body = render(collect(self.snapshot_dir)).encode()
+            content_type = 'text/plain; version=0.0.4'
+        elif self.path == '/metrics.json':
+            body = json.dumps(collect(self.snapshot_dir)).encode()
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_http_server(port=None, snapshot_dir=None):
+    # Serves /metrics (Prometheus text) and /metrics.json for the lifetime of the process
+    port = port if port is not None else int(os.getenv('METRICS_PORT', 0) or 0)
+    if not port:
+        return None
+    MetricsHandler.snapshot_dir = snapshot_dir or os.getenv('METRICS_DIR')
+    server = ThreadingHTTPServer(('0.0.0.0', port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+    logger.info(f"Serving metrics on port {port}")
+    return server
@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SCRAPER = os.path.join(BASE_DIR, 'script', 'job_scrapping.py')
+
+logger = logging.getLogger('task_queue')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scrape_tasks (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    task_key TEXT NOT NULL,
+    positions TEXT NOT NULL,
+    locations TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    return_code INTEGER,
+    log_path TEXT,
+    progress_path TEXT,
+    requests INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS scrape_tasks_active_idx ON scrape_tasks (task_key, status);
+"""
+
+ACTIVE_STATUSES = ('queued', 'running')
+
+class TaskQueue:
+    # Scrape runs queued in SQLite and executed one subprocess at a time by background worker threads
+    def __init__(self, data_dir=None, workers=None):
+        self.data_dir = data_dir or os.getenv('UI_DATA_DIR', os.path.join(BASE_DIR, 'ui_data'))
+        self.log_dir = os.path.join(self.data_dir, 'logs')
+        os.makedirs(self.log_dir, exist_ok=True)
+        self.db_path = os.path.join(self.data_dir, 'tasks.sqlite3')
+        # Every run writes its metrics snapshots here for the UI's /metrics endpoint
+        self.metrics_dir = os.getenv('METRICS_DIR', os.path.join(self.data_dir, 'metrics'))
+        # One worker by default: every run drives its own browsers, so runs are serialized rather than stacked
+        self.workers = workers or int(os.getenv('UI_WORKERS', 1))
+        self.wakeup = threading.Event()
+        self.threads = []
+        self.start_lock = threading.Lock()
+        conn = self.connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def submit(self, positions, locations):
+        # Identical searches that are already queued or running are joined instead of started again
+        positions = sorted({position.strip() for position in positions if position.strip()})
+        locations = sorted({location.strip() for location in locations if location.strip()})
+        task_key = json.dumps([positions, locations])
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute(
+                f"SELECT id FROM scrape_tasks WHERE task_key = ? AND status IN {ACTIVE_STATUSES} ORDER BY id LIMIT 1",
+                (task_key,)
+            ).fetchone()
+            if row is not None:
+                conn.execute('UPDATE scrape_tasks SET requests = requests + 1 WHERE id = ?', (row['id'],))
+                conn.execute('COMMIT')
+                logger.info(f"Coalesced request into scrape task {row['id']}")
+                return row['id'], False
+            cursor = conn.execute(
+                'INSERT INTO scrape_tasks (task_key, positions, locations, created_at) VALUES (?, ?, ?, ?)',
+                (task_key, json.dumps(positions), json.dumps(locations), time.time())
+            )
+            task_id = cursor.lastrowid
+            conn.execute(
+                'UPDATE scrape_tasks SET log_path = ?, progress_path = ? WHERE id = ?',
+                (os.path.join(self.log_dir, f'{task_id}.log'), os.path.join(self.log_dir, f'{task_id}.progress.json'),
+                 task_id)
+            )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        logger.info(f"Queued scrape task {task_id}")
+        self.wakeup.set()
+        return task_id, True
+
+    def get(self, task_id):
+        conn = self.connect()
+        try:
+            row = conn.execute('SELECT * FROM scrape_tasks WHERE id = ?', (task_id,)).fetchone()
+        finally:
+            conn.close()
+        return self.describe(row) if row is not None else None
+
+    def recent(self, limit=20):
+        conn = self.connect()
+        try:
+            rows = conn.execute('SELECT * FROM scrape_tasks ORDER BY id DESC LIMIT ?', (limit,)).fetchall()
+        finally:
+            conn.close()
+        return [self.describe(row) for row in rows]
+
+    def describe(self, row):
+        task = dict(row)
+        task['positions'] = json.loads(task['positions'])
+        task['locations'] = json.loads(task['locations'])
+        task['progress'] = None
+        if task['progress_path'] and os.path.exists(task['progress_path']):
+            try:
+                with open(task['progress_path']) as file:
+                    task['progress'] = json.load(file)
+            except (OSError, ValueError):
+                pass
+        del task['task_key']
+        return task
+
+    def read_log(self, task_id, offset=0, limit=65536):
+        task = self.get(task_id)
+        if task is None or not task['log_path'] or not os.path.exists(task['log_path']):
+            return b'', offset
+        with open(task['log_path'], 'rb') as file:
+            file.seek(offset)
+            chunk = file.read(limit)
+        return chunk, offset + len(chunk)
+
+    def claim(self):
+        conn = self.connect()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            row = conn.execute("SELECT * FROM scrape_tasks WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+            if row is not None:
+                conn.execute("UPDATE scrape_tasks SET status = 'running', started_at = ? WHERE id = ?",
+                             (time.time(), row['id']))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        finally:
+            conn.close()
+        return row
+
+    def finish(self, task_id, return_code):
+        status = 'succeeded' if return_code == 0 else 'failed'
+        conn = self.connect()
+        try:
+            conn.execute('UPDATE scrape_tasks SET status = ?, finished_at = ?, return_code = ? WHERE id = ?',
+                         (status, time.time(), return_code, task_id))
+        finally:
+            conn.close()
+        logger.info(f"Scrape task {task_id} {status} with exit code {return_code}")
+
+    def run_task(self, row):
+        cmd = [sys.executable, SCRAPER, '--position', *json.loads(row['positions']),
+               '--location', *json.loads(row['locations']), '--progress-file', row['progress_path']]
+        logger.info(f"Running scrape task {row['id']}: {' '.join(cmd)}")
+        try:
+            with open(row['log_path'], 'ab') as log:
+                process = subprocess.Popen(cmd, cwd=BASE_DIR, stdout=log, stderr=subprocess.STDOUT,
+                                           env=dict(os.environ, PYTHONUNBUFFERED='1', METRICS_DIR=self.metrics_dir))
+                return_code = process.wait()
+        except Exception as e:
+            logger.error(f"Error running scrape task {row['id']}: {e}")
+            return_code = -1
+        self.finish(row['id'], return_code)
+
+    def work(self):
+        while True:
+            row = self.claim()
+            if row is None:
+                self.wakeup.wait(timeout=5)
+                self.wakeup.clear()
+                continue
+            self.run_task(row)
+
+    def recover(self):
+        # A run still marked running at startup belonged to a server process that is gone
+        conn = self.connect()
+        try:
+            cursor = conn.execute(
+                "UPDATE scrape_tasks SET status = 'failed', finished_at = ? WHERE status = 'running'", (time.time(),)
+            )
+        finally:
+            conn.close()
+        if cursor.rowcount:
+            logger.warning(f"Marked {cursor.rowcount} interrupted scrape task(s) as failed")
+
+    def start(self):
+        with self.start_lock:
+            if self.threads:
+                return
+            self.recover()
+            for worker_id in range(self.workers):
+                thread = threading.Thread(target=self.work, name=f"scrape-task-worker-{worker_id}", daemon=True)
+                thread.start()
+                self.threads.append(thread)
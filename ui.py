@@ -1,8 +1,23 @@
-from flask import Flask, render_template, request
-import subprocess
-import shlex
+from flask import Flask, Response, abort, jsonify, redirect, render_template, request, stream_with_context, url_for
+import os
+import sys
+import time
+from task_queue import TaskQueue
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'script'))
+
+import metrics
+from logging_setup import setup_logging
+
+setup_logging()
 
 app = Flask(__name__)
+task_queue = TaskQueue()
+
+@app.before_request
+def start_task_workers():
+    # Started on the first request so the debug reloader's parent process never runs scrapes
+    task_queue.start()
 
 @app.route('/')
 def index():
@@ -13,20 +28,68 @@ def run_script():
     job_keywords = request.form['job_keywords']
     location_keywords = request.form['location_keywords']
 
-    # Convert the comma-separated strings to lists
-    job_keywords_list = job_keywords.split(';')
-    location_keywords_list = location_keywords.split(';')
+    # Convert the semicolon-separated strings to lists, leaving out blank entries
+    job_keywords_list = [keyword.strip() for keyword in job_keywords.split(';') if keyword.strip()]
+    location_keywords_list = [keyword.strip() for keyword in location_keywords.split(';') if keyword.strip()]
+    if not job_keywords_list or not location_keywords_list:
+        # The scraper's --position and --location need at least one value each
+        return jsonify({'error': 'Enter at least one position and one location.'}), 400
+
+    # Queue the scrape and answer right away; identical requests join the run that is already queued
+    task_id, created = task_queue.submit(job_keywords_list, location_keywords_list)
+    if request.accept_mimetypes.best == 'application/json':
+        return jsonify({'id': task_id, 'coalesced': not created,
+                        'status_url': url_for('task_status', task_id=task_id)}), 202
+    return redirect(url_for('task_page', task_id=task_id))
+
+@app.route('/tasks')
+def list_tasks():
+    return jsonify(task_queue.recent(limit=request.args.get('limit', 20, type=int)))
+
+@app.route('/tasks/<int:task_id>')
+def task_page(task_id):
+    task = task_queue.get(task_id)
+    if task is None:
+        abort(404)
+    return render_template('output.html', task=task)
+
+@app.route('/tasks/<int:task_id>/status')
+def task_status(task_id):
+    task = task_queue.get(task_id)
+    if task is None:
+        abort(404)
+    return jsonify(task)
+
+@app.route('/tasks/<int:task_id>/log')
+def task_log(task_id):
+    if task_queue.get(task_id) is None:
+        abort(404)
+    offset = request.args.get('offset', 0, type=int)
+    if not request.args.get('follow'):
+        chunk, offset = task_queue.read_log(task_id, offset)
+        return Response(chunk, mimetype='text/plain', headers={'X-Log-Offset': str(offset)})
 
-    # Construct the command to run your script with arguments
-    # Assuming your Python script is named 'your_script.py'
-    cmd = f"python ./script/job_scrapping.py --position {' '.join(job_keywords_list)} --location {' '.join(location_keywords_list)}"
+    def follow(offset):
+        # Stream the log as it grows until the task is done and everything written has been sent
+        while True:
+            chunk, offset = task_queue.read_log(task_id, offset)
+            if chunk:
+                yield chunk
+                continue
+            if task_queue.get(task_id)['status'] not in ('queued', 'running'):
+                return
+            time.sleep(1)
 
-    # Execute the command and capture the output
-    process = subprocess.Popen(shlex.split(cmd), stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = process.communicate()
+    return Response(stream_with_context(follow(offset)), mimetype='text/plain')
 
-    # Send the output back to the web page
-    return render_template('output.html', output=stdout.decode(), error=stderr.decode())
+@app.route('/metrics')
+def prometheus_metrics():
+    # Totals from every scrape run the queue started, read from the snapshots each run writes
+    # Snapshots of runs that have finished are folded into one totals file as they are read
+    snapshot = metrics.collect(task_queue.metrics_dir, compact_finished=True)
+    return Response(metrics.render(snapshot), mimetype='text/plain; version=0.0.4')
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    # UI_HOST=0.0.0.0 makes the UI, and its /metrics endpoint, reachable from other containers
+    app.run(host=os.getenv('UI_HOST', '127.0.0.1'), port=int(os.getenv('UI_PORT', 5000)),
+            debug=os.getenv('UI_DEBUG', 'true').lower() in ('1', 'true', 'yes'))